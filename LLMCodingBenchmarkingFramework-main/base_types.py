@@ -1,7 +1,9 @@
-from typing import Dict, List, Union, Optional, Any
+from typing import Callable, Dict, List, Union, Optional, Any
 import ast
+import functools
 import json
 import re
+import threading
 
 # Define necessary types
 ProblemID = str
@@ -105,6 +107,9 @@ class SolutionGrade:
 		self.model_identifier = model_identifier
 		self.sub_criteria_scores = sub_criteria_scores
 		self.issues = issues
+		# Profile of the solution, encoded by execution.encode_profile, which is saved next to the grade rather
+		# than in it
+		self.profile = None
 
 	@classmethod
 	def from_json(cls, data: Dict[str, Any]) -> 'SolutionGrade':
@@ -216,6 +221,8 @@ class TestCase:
 	def __init__(self, data: Dict[str, Any]):
 		self.parameters = data.get('input', {})
 		self.expected_output = data.get('expected_output', {})
+		# Parameters and return values converted by FunctionPrototype, keyed by the prototype's signature
+		self.converted_values = {}
 	
 	@classmethod
 	def from_json(cls, data: Dict[str, Any]) -> 'TestCase':
@@ -233,11 +240,108 @@ class TestCase:
 		return f'Input: {inputs_str}; Expected Output: {expected_output_str}'
 
 
+def split_type_arguments(arguments: str) -> List[str]:
+	"""
+	Splits the arguments of a generic type string, e.g. "int, List[str]", at the commas outside brackets.
+	"""
+	parts, depth, start = [], 0, 0
+	for index, character in enumerate(arguments):
+		if character == '[':
+			depth += 1
+		elif character == ']':
+			depth -= 1
+		elif character == ',' and depth == 0:
+			parts.append(arguments[start:index].strip())
+			start = index + 1
+	parts.append(arguments[start:].strip())
+	return [part for part in parts if part]
+
+def identity(value):
+	return value
+
+@functools.lru_cache(maxsize=None)
+def compile_element_converter(type_string: str) -> Callable[[Any], Any]:
+	"""
+	Compiles the type of a value nested in a container into a function that converts string representations of
+	scalars to their type and converts the elements of nested containers, leaving the containers' types as they are.
+	"""
+	type_string = type_string.strip()
+	match = re.match(r'^(\w+)\[(.*)\]$', type_string)
+	if match is None:
+		scalar_type = {'int': int, 'float': float}.get(type_string)
+		if scalar_type is not None:
+			return lambda value: scalar_type(value) if isinstance(value, str) else value
+		if type_string == 'bool':
+			return lambda value: value.lower() == "true" if isinstance(value, str) else value
+		return identity
+	
+	container, arguments = match.group(1).lower(), split_type_arguments(match.group(2))
+	converters = [compile_element_converter(argument) for argument in arguments]
+	if container == 'optional' and len(converters) == 1:
+		convert = converters[0]
+		return lambda value: None if value is None else convert(value)
+	if container in ('list', 'set', 'frozenset', 'sequence', 'iterable') and len(converters) == 1:
+		convert = converters[0]
+		if convert is identity:
+			return identity
+		return lambda value: type(value)(convert(element) for element in value) if isinstance(value, (list, tuple, set, frozenset)) else value
+	if container == 'tuple':
+		if len(arguments) == 2 and arguments[1] == '...':
+			converters = [converters[0]]
+		if all(convert is identity for convert in converters):
+			return identity
+		if len(converters) == 1:
+			convert = converters[0]
+			return lambda value: type(value)(convert(element) for element in value) if isinstance(value, (list, tuple)) else value
+		return lambda value: type(value)(convert(element) for convert, element in zip(converters, value)) if isinstance(value, (list, tuple)) and len(value) == len(converters) else value
+	if container in ('dict', 'mapping') and len(converters) == 2:
+		convert = converters[1]
+		if convert is identity:
+			return identity
+		# Keys are left as they are, since JSON objects only have string keys
+		return lambda value: {key: convert(element) for key, element in value.items()} if isinstance(value, dict) else value
+	return identity
+
+@functools.lru_cache(maxsize=None)
+def compile_converter(type_string: str) -> Callable[[Any], Any]:
+	"""
+	Compiles the type of a parameter or return value, as written in a function prototype, into a function that
+	converts a value from a test case to that type.
+	"""
+	match = re.search(r'^Optional\[(.*)\]$', type_string)
+	param_type = match.group(1) if match else type_string
+	
+	if param_type == "int":
+		convert = int
+	elif param_type == "float":
+		convert = float
+	elif param_type == "str":
+		convert = lambda input: ast.literal_eval(f'"{input}"')  # Adding double quotes around the string
+	elif param_type == "bool":
+		convert = lambda input: input.lower() == "true"
+	elif '[' in param_type:
+		# Using ast.literal_eval to safely evaluate the string representation, then converting nested values
+		convert_elements = compile_element_converter(param_type)
+		convert = lambda input: convert_elements(ast.literal_eval(input) if isinstance(input, str) else input)
+	else:
+		convert = identity  # Return the input as-is for unsupported types
+	
+	def converter(input):
+		if input is None:
+			return None
+		elif isinstance(input, str):
+			input = input[1:-1] if (input.startswith("'") and input.endswith("'")) or (input.startswith('"') and input.endswith('"')) else input
+		return convert(input)
+	return converter
+
 class FunctionPrototype:
 	def __init__(self, data):
 		self.function_name = data["function_name"]
 		self.parameters = [Parameter(p) for p in data["parameters"]]
 		self.return_values = [ReturnValue(r) for r in data["return_values"]]
+		self.signature = (tuple((p.name, p.type) for p in self.parameters), tuple(r.type for r in self.return_values))
+		self.parameter_converters = [(p.name, compile_converter(p.type)) for p in self.parameters]
+		self.return_value_converters = [compile_converter(r.type) for r in self.return_values]
 
 	@classmethod
 	def from_json(cls, data: Dict[str, Any]) -> 'FunctionPrototype':
@@ -265,54 +369,50 @@ class FunctionPrototype:
 	
 	def get_python_type(self, param_type, input):
 		# Based on the type, convert the string representation to the appropriate Python object
-		param_type = re.search(r'^Optional\[(.*)\]$', param_type).group(1) if re.search(r'^Optional\[(.*)\]$', param_type) else param_type
-		if input is None:
-			return None
-		elif isinstance(input, str):
-			input = input[1:-1] if (input.startswith("'") and input.endswith("'")) or (input.startswith('"') and input.endswith('"')) else input
-		if param_type == "int":
-			return int(input)
-		elif param_type == "float":
-			return float(input)
-		elif param_type == "str":
-			return ast.literal_eval(f'"{input}"')  # Adding double quotes around the string
-		elif param_type == "bool":
-			return input.lower() == "true"
-		elif '[' in param_type and isinstance(input, str):  # Ensure input is a string
-			# Using ast.literal_eval to safely evaluate the string representation
-			return ast.literal_eval(input)
-		else:
-			return input  # Return the input as-is for unsupported types or if input is not a string
-		
+		return compile_converter(param_type)(input)
+	
+	# The converted values are cached on the test case and shared between callers, which must not modify them
+	
 	def get_parameter_values(self, test_case: TestCase) -> Dict[str, Any]:
-		converted_params = {}
-		
-		for param in self.parameters:
-			converted_params[param.name] = self.get_python_type(param.type, test_case.parameters[param.name])
+		key = (self.signature, 'parameters')
+		converted_params = test_case.converted_values.get(key)
+		if converted_params is None:
+			converted_params = {name: convert(test_case.parameters[name]) for name, convert in self.parameter_converters}
+			test_case.converted_values[key] = converted_params
 		return converted_params
 		
 	def get_ordered_parameter_values(self, test_case) -> List[str]:
-		ordered_parameters = []
-		
-		parameter_values = self.get_parameter_values(test_case)
-		
-		for p in self.parameters:
-			ordered_parameters.append(parameter_values[p.name])
+		key = (self.signature, 'ordered_parameters')
+		ordered_parameters = test_case.converted_values.get(key)
+		if ordered_parameters is None:
+			parameter_values = self.get_parameter_values(test_case)
+			ordered_parameters = [parameter_values[p.name] for p in self.parameters]
+			test_case.converted_values[key] = ordered_parameters
 		return ordered_parameters
 		
+	def order_parameter_values(self, values: Dict[str, Any]) -> List[Any]:
+		"""
+		Orders values that are already Python objects, by parameter name, as the function takes them, without
+		converting them. Raises a KeyError naming the first parameter missing from values.
+		"""
+		missing = [p.name for p in self.parameters if p.name not in values]
+		if missing:
+			raise KeyError(f"missing value for parameter '{missing[0]}'")
+		return [values[p.name] for p in self.parameters]
+	
 	def get_return_values(self, test_case: TestCase) -> Dict[str, Any]:
-		converted_retvals = []
-		
-		expectedOutput = test_case.expected_output
+		key = (self.signature, 'return_values')
+		if key in test_case.converted_values:
+			return test_case.converted_values[key]
 		
-		for retval, expected in zip(self.return_values, expectedOutput):
-			converted_retval = self.get_python_type(retval.type, expected)
-			# Extract the type of the parameter
-			converted_retvals.append(converted_retval)
+		converted_retvals = [convert(expected) for convert, expected in zip(self.return_value_converters, test_case.expected_output)]
 		
 		if len(converted_retvals) == 1:
-			return converted_retvals[0]
-		return tuple(converted_retvals)
+			converted_retvals = converted_retvals[0]
+		else:
+			converted_retvals = tuple(converted_retvals)
+		test_case.converted_values[key] = converted_retvals
+		return converted_retvals
 
 class Parameter:
 	def __init__(self, data):
@@ -407,20 +507,54 @@ class ProblemDefinition:
 				 function_prototype: 'FunctionPrototype' = None,
 				 correctness_test_suite: Optional[List['TestCase']] = None,
 				 optimal_solution: Optional[str] = None,
-				 tags: Optional[List[str]] = None):
+				 tags: Optional[List[str]] = None,
+				 correctness_test_suite_loader: Optional[Callable[[], List['TestCase']]] = None):
 		self.identifier = identifier
 		self.prompts = prompts
 		self.function_prototype = function_prototype
-		self.correctness_test_suite = correctness_test_suite
+		self._correctness_test_suite = correctness_test_suite
+		self._correctness_test_suite_loader = correctness_test_suite_loader
+		# Graders read the test cases from several threads; only one of them calls the loader
+		self._correctness_test_suite_lock = threading.Lock()
 		self.optimal_solution = optimal_solution
 		self.tags = tags
 		self.additional_fields = {}  # New attribute to store additional fields
 	
+	@property
+	def correctness_test_suite(self) -> Optional[List['TestCase']]:
+		"""
+		The test cases of the problem. When the problem was loaded with a correctness_test_suite_loader, the test
+		cases are only loaded the first time they are used.
+		"""
+		if self._correctness_test_suite_loader is not None:
+			with self._correctness_test_suite_lock:
+				loader = self._correctness_test_suite_loader
+				if loader is not None:
+					self._correctness_test_suite = loader()
+					self._correctness_test_suite_loader = None
+		return self._correctness_test_suite
+	
+	@correctness_test_suite.setter
+	def correctness_test_suite(self, correctness_test_suite: Optional[List['TestCase']]):
+		with self._correctness_test_suite_lock:
+			self._correctness_test_suite = correctness_test_suite
+			self._correctness_test_suite_loader = None
+	
+	@property
+	def is_correctness_test_suite_loaded(self) -> bool:
+		return self._correctness_test_suite_loader is None
+	
 	@classmethod
-	def from_json(cls, data: Dict[str, Any]) -> 'ProblemDefinition':
+	def from_json(cls, data: Dict[str, Any], correctness_test_suite_loader: Optional[Callable[[], List['TestCase']]] = None) -> 'ProblemDefinition':
+		"""
+		Builds a problem from its JSON. If correctness_test_suite_loader is given, the correctness_test_suite in
+		data is ignored and the loader is called instead when the test cases are first used.
+		"""
 		function_prototype = FunctionPrototype.from_json(data.get('function_prototype', {}))
 		prompts = [Prompt.from_json(prompt_data) for prompt_data in data.get("prompts", [])]
-		correctness_test_suite = [TestCase.from_json(test_case) for test_case in data.get('correctness_test_suite', [])]
+		correctness_test_suite = None
+		if correctness_test_suite_loader is None:
+			correctness_test_suite = [TestCase.from_json(test_case) for test_case in data.get('correctness_test_suite', [])]
 		
 		# Known fields from the JSON
 		known_fields = [
@@ -437,7 +571,8 @@ class ProblemDefinition:
 			function_prototype=function_prototype,
 			correctness_test_suite=correctness_test_suite,
 			optimal_solution=data.get('optimal_solution', None),
-			tags=data.get('tags', None)
+			tags=data.get('tags', None),
+			correctness_test_suite_loader=correctness_test_suite_loader
 		)
 		instance.additional_fields = additional_fields  # Assign additional fields to the instance
 		return instance
@@ -457,7 +592,10 @@ class ProblemDefinition:
 	
 	def __str__(self) -> str:
 		prompts_str = '\n    '.join(str(prompt) for prompt in self.prompts)
-		correctness_test_suite_str = '\n    '.join(str(test_case) for test_case in self.correctness_test_suite) if self.correctness_test_suite else "No Test Cases"
+		if not self.is_correctness_test_suite_loaded:
+			correctness_test_suite_str = "Loaded on first use"
+		else:
+			correctness_test_suite_str = '\n    '.join(str(test_case) for test_case in self.correctness_test_suite) if self.correctness_test_suite else "No Test Cases"
 		tags_str = ', '.join(self.tags) if self.tags else "No Tags"
 		
 		# Convert the additional fields dictionary to a readable string
@@ -1,9 +1,14 @@
 import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from base_types import *
 import json
+import cache
 import grader
+import execution
 import serialization
 import querier
+import openai
 import sys
 import os
 import validation
@@ -12,26 +17,42 @@ import datetime
 def load_problems(base_path):
 	return serialization.get_problems(base_path)
 
-def validate_problems(base_path):
-	validation_results = {}
-	
+def validate_problems(base_path, jobs=1):
 	problemsJSON = serialization.get_problems_json(base_path)
 	
-	for fileName, json in problemsJSON.items():
-		validation_results[fileName] = validation.validate_problem_json(json)
-		print(f'{fileName}: {validation_results[fileName]}')
+	# Problems are validated in parallel; each optimal solution runs on a worker of the default pool
+	with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+		results = executor.map(validation.validate_problem_json, problemsJSON.values())
+		validation_results = dict(zip(problemsJSON.keys(), results))
+	
+	for fileName, validation_result in validation_results.items():
+		print(f'{fileName}: {validation_result}')
 	return validation_results
 
-def generate_solutions(base_path, problem_definitions, models):
-	solutions = []	
-	for model in models:
-		for problem_definition in problem_definitions:
-			inputs = problem_definition.get_llm_problem_inputs()
-			for problem_input in inputs:
-				solution = model.generate_solution(problem_input)
-				solutions.append(solution)
-				serialization.save_solution(base_path, solution)
-	return solutions
+async def generate_solutions_async(base_path, problem_definitions, models, concurrency, rate_limits):
+	semaphore = asyncio.Semaphore(concurrency)
+	
+	async def generate(model, problem_input):
+		async with semaphore:
+			try:
+				solution = await model.generate_solution_async(problem_input, rate_limits)
+			except Exception as e:
+				print(f"Failed to generate a solution to prompt {problem_input.prompt_id} of problem {problem_input.problem_id} with model {model.model_identifier}: {e}")
+				return None
+		# Save each solution as soon as it arrives, so that an interrupted run keeps what it has generated
+		serialization.save_solution(base_path, solution)
+		return solution
+	
+	tasks = [generate(model, problem_input)
+			for model in models
+			for problem_definition in problem_definitions
+			for problem_input in problem_definition.get_llm_problem_inputs()]
+	solutions = await asyncio.gather(*tasks)
+	return [solution for solution in solutions if solution is not None]
+
+def generate_solutions(base_path, problem_definitions, models, concurrency=1, requests_per_minute=None, tokens_per_minute=None):
+	rate_limits = querier.RateLimits(requests_per_minute, tokens_per_minute)
+	return asyncio.run(generate_solutions_async(base_path, problem_definitions, models, max(1, concurrency), rate_limits))
 	
 def load_solutions(base_path, models):
 	solutions = []
@@ -39,17 +60,22 @@ def load_solutions(base_path, models):
 		solutions += serialization.load_solutions(base_path, model.model_identifier)
 	return solutions
 
-def grade_solutions(base_path, problem_definitions, models, graders, current_report_paths):
+def grade_solutions(base_path, problem_definitions, models, graders, report_writers, refresh_baselines=False):
 	gradingOutputs = []
+	baseline_cache = cache.BaselineCache(base_path, refresh=refresh_baselines)
 	for grader in graders:
 		if not grader.can_grade(problem_definitions):
 			continue
+		grader.baseline_cache = baseline_cache
 		for model in models:
 			print(f'Grading solutions for {base_path} from model {model.model_identifier} with grader {grader.identifier}')
+			report_writer = report_writers[model]
 			solutions = serialization.get_solutions(base_path, model.model_identifier)
+			# Skip solutions already graded by an interrupted run that is being resumed
+			solutions = [s for s in solutions if not report_writer.has_grade(base_path, grader.identifier, s)]
 			grades = grader.grade(problem_definitions, solutions)
-			current_report_path = current_report_paths[model]
-			serialization.save_grades(base_path, grades, current_report_path)
+			serialization.save_grades(base_path, grades, report_writer)
+			baseline_cache.save()
 			gradingOutputs.append(grades)
 	print(gradingOutputs)
 	return gradingOutputs
@@ -80,32 +106,104 @@ def print_header(text, symbol='#'):
 def main():
 	parser = argparse.ArgumentParser(description="Run specified phases of the grading process.")
 	parser.add_argument('--base_path', nargs='*', default=None, help="The base path(s) for data files. If this arg is not set, run all problem sets in ./problem_sets")
+	parser.add_argument('--pack', action='store_true', help=f"Pack the problems, solutions and grades of each problem set into a single {serialization.PACKED_FILE_NAME} file, which is then used in place of the directories.")
+	parser.add_argument('--unpack', action='store_true', help=f"Write the contents of each problem set's {serialization.PACKED_FILE_NAME} back to directories and remove it.")
 	parser.add_argument('--validate', action='store_true', help="Validate the problem definition JSON.")
 	parser.add_argument('--generate', action='store_true', help="Generate solutions for problems.")
 	parser.add_argument('--grade', action='store_true', help="Grade the generated solutions.")
 	parser.add_argument('--model', required='--generate' in sys.argv or '--grade' in sys.argv, nargs='+', help=f"The model(s) to use for generating solutions The following model names can be queried through the OpenAI API: {querier.OpenAIModelQuerier.supported_model_names()}")
 	parser.add_argument('--grader', required='--grade' in sys.argv, nargs='+', help="The grader(s) to use for grading solutions.")
 	parser.add_argument('--force-human', action='store_true', help="Always use the interactive human model querier.")
+	parser.add_argument('--concurrency', type=int, default=1, help="Maximum number of prompts sent to the OpenAI API at the same time. Default= 1")
+	parser.add_argument('--requests-per-minute', type=float, default=None, help="Rate limit on OpenAI API requests. Requests are delayed to stay below it. Default: no limit")
+	parser.add_argument('--tokens-per-minute', type=float, default=None, help="Rate limit on OpenAI API tokens, estimated from the prompt length and the largest completion. Default: no limit")
+	parser.add_argument('--no-response-cache', action='store_true', help="Query the model for every prompt, even those it has already answered.")
+	parser.add_argument('--response-cache-path', default=cache.DEFAULT_RESPONSE_CACHE_PATH, help=f"SQLite file caching the model responses to each prompt. Default= {cache.DEFAULT_RESPONSE_CACHE_PATH}")
+	parser.add_argument('--api-base', default=None, help="Base URL of the OpenAI API, e.g. to use a proxy or a local test server. Default: $OPENAI_API_BASE or the public API")
 	parser.add_argument('--report-path', default=None, help="Location in which to store reports generated during each run. Default= ./reports")
+	parser.add_argument('--resume', default=None, metavar='TIMESTAMP', help="Resume an interrupted run by reusing the timestamp of its reports (e.g. 10-17-2026--09-30-00). Grades already recorded in their logs are not graded again.")
+	parser.add_argument('--refresh-baselines', action='store_true', help="Re-measure the optimal solutions instead of reusing the measurements cached in each problem set's baselines.json.")
+	parser.add_argument('--no-result-cache', action='store_true', help="Grade every solution, even those whose code and problem are unchanged since they were last graded.")
+	parser.add_argument('--result-cache-path', default=cache.DEFAULT_RESULT_CACHE_PATH, help=f"Directory of the cache of grades for unchanged solutions. Default= {cache.DEFAULT_RESULT_CACHE_PATH}")
+	parser.add_argument('--result-cache-size', type=int, default=cache.DEFAULT_RESULT_CACHE_MAX_BYTES // (1024 * 1024), help="Size, in megabytes, above which the least recently used cached grades are evicted. Default= %(default)s")
+	parser.add_argument('--cache-stats', action='store_true', help="Print statistics about the grade and response caches and exit.")
+	parser.add_argument('--jobs', type=int, default=1, help="Number of solutions to grade, or problems to validate, in parallel, each on its own worker process. Timings taken by the performance grader are noisier when this is above 1. Default= 1")
+	parser.add_argument('--memory-backend', choices=execution.MEMORY_BACKENDS, default=execution.DEFAULT_MEMORY_BACKEND, help="How the memory grader measures peak memory: tracemalloc traces Python allocations only and is slow, rss takes the resident set high-water mark of a fresh process per test case, and sampling samples the resident set size while the code runs. Default= %(default)s")
+	parser.add_argument('--performance-scaling', action='store_true', help="Grade performance by timing solutions on inputs of growing size, made by each problem's input_generator, and comparing the complexities fitted to their times instead of timing the test suite. Problems without an input_generator are still graded on their test suite.")
+	parser.add_argument('--profile', action='store_true', help="Profile the solutions timed by the performance grader with cProfile, saving each profile next to its grade as grades/<model>/performance/<problem>/<prompt>.prof and listing the hottest functions as issues.")
+	parser.add_argument('--timeout', type=float, default=execution.DEFAULT_TIMEOUT, help="Wall-clock limit, in seconds, for each test case. Problems can override it with their execution_limits field. Default= %(default)s")
+	parser.add_argument('--cpu-time-limit', type=float, default=execution.DEFAULT_LIMITS['cpu_time'], help="CPU time limit, in seconds, for each test case. Default= %(default)s")
+	parser.add_argument('--memory-limit', type=int, default=execution.DEFAULT_LIMITS['memory'] // (1024 * 1024), help="Address space limit, in megabytes, for the code under test. Default= %(default)s")
+	parser.add_argument('--max-processes', type=int, default=None, help="Limit on the processes and threads of the user running the code under test, to stop fork bombs. Not enforced for root. Default: no limit")
 	args = parser.parse_args()
 
 	problem_definitions = []
 	
+	if args.cache_stats:
+		result_cache = cache.ResultCache(args.result_cache_path, args.result_cache_size * 1024 * 1024)
+		print("Grade cache:")
+		for name, value in result_cache.stats().items():
+			print(f"\t{name}: {value}")
+		print("Response cache:")
+		# Opening the response cache creates its database, so a missing one is reported instead
+		if not os.path.exists(args.response_cache_path):
+			print(f"\tpath: {args.response_cache_path} (not created yet)")
+			return
+		for name, value in cache.ResponseCache(args.response_cache_path).stats().items():
+			print(f"\t{name}: {value}")
+		return
+	# Opening the grade cache scans every grade it holds, so it is only opened when grading
+	result_cache = None
+	if args.grade and not args.no_result_cache:
+		result_cache = cache.ResultCache(args.result_cache_path, args.result_cache_size * 1024 * 1024)
+	# Likewise the response cache is only opened, and its database created, when generating
+	response_cache = None
+	if args.generate and not args.no_response_cache:
+		response_cache = cache.ResponseCache(args.response_cache_path)
+	
+	if args.api_base:
+		openai.api_base = args.api_base
+	
 	if args.model:
-		models = querier.AIModelQuerier.resolve_queriers(args.model, args.force_human)
+		models = querier.AIModelQuerier.resolve_queriers(args.model, args.force_human, response_cache)
 	if args.grader:
-		graders = grader.Grader.resolve_graders(args.grader)
+		graders = grader.Grader.resolve_graders(args.grader, jobs=args.jobs, result_cache=result_cache)
+		for g in graders:
+			if isinstance(g, grader.MemoryGrader):
+				g.memory_backend = args.memory_backend
+			if isinstance(g, grader.PerformanceGrader):
+				if args.performance_scaling:
+					g.scaling = {}
+				g.profile = args.profile
+	
+	limits = {
+		'timeout': args.timeout,
+		'cpu_time': args.cpu_time_limit,
+		'memory': args.memory_limit * 1024 * 1024,
+		'processes': args.max_processes
+	}
+	execution.configure_default_pool(size=max(1, args.jobs), timeout=args.timeout, limits=limits)
 	
 	if args.base_path is None:
 		args.base_path = [os.path.join('problem_sets', d) for d in os.listdir('problem_sets') if os.path.isdir(os.path.join('problem_sets', d))]
 
 	if args.report_path is None:
 		args.report_path = 'reports'
+	
+	if args.pack or args.unpack:
+		for base_path in args.base_path:
+			if args.pack:
+				print(f"Packing {base_path}…")
+				serialization.pack_problem_set(base_path)
+			else:
+				print(f"Unpacking {base_path}…")
+				serialization.unpack_problem_set(base_path)
+		return
 		
 	if args.validate:
 		print_header('Validation')
 		print("Validating problems…")
-		all_validation_results = {x: validate_problems(x) for x in args.base_path}
+		all_validation_results = {x: validate_problems(x, args.jobs) for x in args.base_path}
 		print("Validation results:")
 		for base_path, validation_results in all_validation_results.items():
 			print(f"{base_path}:")
@@ -114,16 +212,16 @@ def main():
 	
 	if args.generate or args.grade:
 		# generate timestamp to identify final report:
-		timestamp = datetime.datetime.now().strftime("%m-%d-%Y--%H-%M-%S")
+		timestamp = args.resume or datetime.datetime.now().strftime("%m-%d-%Y--%H-%M-%S")
 		current_report_paths = {m: os.path.join(args.report_path, "report-" + m.model_identifier + "-" + timestamp + ".json") for m in models}
+		report_writers = {m: serialization.ReportWriter(path) for m, path in current_report_paths.items()}
 
-		print_header('Problems')
-		print("Loading problems…")
-		problem_sets = {x: load_problems(x) for x in args.base_path}
-	
-		# Run benchmarks on all problem sets sequentially
-		for base_path, problem_definitions in problem_sets.items():
+		# Run benchmarks on all problem sets sequentially, loading each set only when it is reached
+		for base_path in args.base_path:
 			print(f"\n***\n*** Problem set {base_path}\n***\n")
+			print_header('Problems')
+			print(f"Loading problems from {base_path}…")
+			problem_definitions = load_problems(base_path)
 			for problem_definition in problem_definitions:
 				print(problem_definition)
 				print()
@@ -131,13 +229,13 @@ def main():
 			if args.generate:
 				print_header('Generation')
 				print("Generating solutions…")
-				solutions = generate_solutions(base_path, problem_definitions, models)
+				solutions = generate_solutions(base_path, problem_definitions, models, args.concurrency, args.requests_per_minute, args.tokens_per_minute)
 				print(solutions)
 			
 			if args.grade:
 				print_header('Grading')
 				print("Grading solutions…")
-				grading_outputs = grade_solutions(base_path, problem_definitions, models, graders, current_report_paths)
+				grading_outputs = grade_solutions(base_path, problem_definitions, models, graders, report_writers, args.refresh_baselines)
 	
 				for output in grading_outputs:
 					print(output.str_including_solutions())
@@ -146,6 +244,14 @@ def main():
 	
 				for output in grading_outputs:
 					print(output)
+		
+		for report_writer in report_writers.values():
+			report_writer.close()
+		
+		if args.generate and response_cache is not None:
+			print(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+		if args.grade and result_cache is not None:
+			print(f"Grade cache: {result_cache.hits} hits, {result_cache.misses} misses")
 
 if __name__ == "__main__":
 	main()
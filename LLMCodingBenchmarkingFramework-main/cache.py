@@ -0,0 +1,285 @@
+from base_types import *
+import execution
+import hashlib
+import os
+import pathlib
+import platform
+import sqlite3
+import sys
+import threading
+
+def hash_text(text: str) -> str:
+	return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def machine_fingerprint() -> str:
+	"""
+	Identifies the host and interpreter that measurements were taken on.
+	"""
+	return hash_text(json.dumps([
+		sys.version,
+		platform.node(),
+		platform.platform(),
+		platform.machine(),
+		platform.processor(),
+		os.cpu_count()
+	]))
+
+class BaselineCache:
+	"""
+	Persistent store of the measurements taken from a problem set's optimal solutions, so that graders measure
+	each baseline once instead of once per candidate solution.
+	Entries are keyed by the optimal solution, the test case, the measurement settings, the Python version and
+	the machine, and are kept in problem_sets/<set>/baselines.json. With refresh set, entries stored by earlier
+	runs are ignored and re-measured; those that are not re-measured are kept in the file.
+	"""
+	FILE_NAME = "baselines.json"
+
+	def __init__(self, basePath: str, refresh: bool = False):
+		self.path = os.path.join(basePath, BaselineCache.FILE_NAME)
+		self.fingerprint = machine_fingerprint()
+		self.refresh = refresh
+		self.entries = self.load()
+		# Keys measured by this run, which with refresh set are the only hits, and those not yet saved
+		self.measured = set()
+		self.unsaved = set()
+		self.lock = threading.Lock()
+
+	def load(self) -> dict:
+		if not os.path.exists(self.path):
+			return {}
+		with open(self.path) as f:
+			return json.load(f)
+
+	def key(self, optimal_solution: str, test_case: TestCase, settings: dict) -> str:
+		return hash_text(json.dumps([
+			hash_text(optimal_solution),
+			test_case.to_json(),
+			settings,
+			self.fingerprint
+		], sort_keys=True))
+
+	def get(self, key: str) -> Optional[execution.FunctionExecutionResult]:
+		with self.lock:
+			entry = self.entries.get(key) if key in self.measured or not self.refresh else None
+		if entry is None:
+			return None
+		return execution.FunctionExecutionResult(
+			result=entry['result'],
+			cpu_time=entry['cpu_time'],
+			peak_memory=entry['peak_memory'],
+			timing=entry['timing']
+		)
+
+	def put(self, key: str, execution_result: execution.FunctionExecutionResult):
+		with self.lock:
+			self.entries[key] = {
+				'result': execution_result.result,
+				'cpu_time': execution_result.cpu_time,
+				'peak_memory': execution_result.peak_memory,
+				'timing': execution_result.timing
+			}
+			self.measured.add(key)
+			self.unsaved.add(key)
+
+	def save(self):
+		"""
+		Writes the measurements taken by this run into the file, keeping the entries it already holds.
+		"""
+		with self.lock:
+			if not self.unsaved:
+				return
+			entries = self.load()
+			entries.update((key, self.entries[key]) for key in self.unsaved)
+			pathlib.Path(os.path.dirname(self.path) or '.').mkdir(parents=True, exist_ok=True)
+			temporary_path = self.path + ".tmp"
+			with open(temporary_path, 'w') as f:
+				json.dump(entries, f, indent=4)
+			os.replace(temporary_path, self.path)
+			self.entries = entries
+			self.unsaved = set()
+
+# Default location and size bound of the ResultCache
+DEFAULT_RESULT_CACHE_PATH = ".grade_cache"
+DEFAULT_RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Share of max_bytes that eviction trims the ResultCache down to, so that it is not rescanned on every put once full
+RESULT_CACHE_LOW_WATER_MARK = 0.8
+
+class ResultCache:
+	"""
+	Content-addressed, size-bounded store of SolutionGrades, so that re-grading only runs the solutions and
+	problems that changed since the last run.
+	Grades are keyed by the grader identifier, version and settings, the solution code and the parts of the
+	problem definition a grader reads. Each grade is a small JSON file under path; reading one refreshes its
+	modification time, and once the cache grows beyond max_bytes, the least recently used files are evicted
+	until it is back under RESULT_CACHE_LOW_WATER_MARK of max_bytes.
+	"""
+	def __init__(self, path: str = DEFAULT_RESULT_CACHE_PATH, max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+		self.total_bytes = sum(os.path.getsize(entry_path) for entry_path in self.entry_paths())
+		if self.total_bytes > self.max_bytes:
+			self.evict()
+
+	def entry_paths(self) -> List[str]:
+		if not os.path.isdir(self.path):
+			return []
+		return [os.path.join(directory, name) for directory, _, names in os.walk(self.path) for name in names if name.endswith('.json')]
+
+	def key(self, grader_identifier: str, grader_version: int, problem: ProblemDefinition, solution_code: str, grader_settings: Optional[dict] = None, limits: Optional[dict] = None) -> str:
+		test_suite = {
+			'function_prototype': problem.function_prototype.to_json() if problem.function_prototype else None,
+			'correctness_test_suite': [test_case.to_json() for test_case in problem.correctness_test_suite or []],
+			'optimal_solution': problem.optimal_solution,
+			'additional_fields': problem.additional_fields
+		}
+		key_parts = [
+			grader_identifier,
+			grader_version,
+			hash_text(solution_code),
+			hash_text(json.dumps(test_suite, sort_keys=True))
+		]
+		# Only grader settings that are set take part in the key, so that grades cached without any stay valid
+		if grader_settings:
+			key_parts.append(grader_settings)
+		# Likewise only the execution limits that differ from the defaults, as they decide which runs time out or fail
+		changed_limits = {name: value for name, value in (limits or {}).items() if execution.DEFAULT_LIMITS.get(name) != value}
+		if changed_limits:
+			key_parts.append({'limits': changed_limits})
+		return hash_text(json.dumps(key_parts, sort_keys=True))
+
+	def entry_path(self, key: str) -> str:
+		return os.path.join(self.path, key[:2], key + ".json")
+
+	def contains(self, key: str) -> bool:
+		"""
+		Whether a grade is cached for key, without reading it or counting a hit or miss.
+		"""
+		return os.path.exists(self.entry_path(key))
+
+	def get(self, key: str, solution: LLMSolution) -> Optional[SolutionGrade]:
+		"""
+		Returns the cached grade for key, relabelled with the model and prompt of solution, or None.
+		"""
+		entry_path = self.entry_path(key)
+		try:
+			with open(entry_path) as f:
+				grade = SolutionGrade.from_json(json.load(f))
+			os.utime(entry_path)
+		except (OSError, ValueError):
+			with self.lock:
+				self.misses += 1
+			return None
+		with self.lock:
+			self.hits += 1
+		grade.problem_identifier = solution.problem_identifier
+		grade.model_identifier = solution.model_identifier
+		grade.prompt_identifier = solution.prompt_identifier
+		return grade
+
+	def put(self, key: str, grade: SolutionGrade):
+		entry_path = self.entry_path(key)
+		pathlib.Path(os.path.dirname(entry_path)).mkdir(parents=True, exist_ok=True)
+		data = json.dumps(grade.to_json())
+		temporary_path = f"{entry_path}.{threading.get_ident()}.tmp"
+		with open(temporary_path, 'w') as f:
+			f.write(data)
+		with self.lock:
+			previous_size = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+			os.replace(temporary_path, entry_path)
+			self.total_bytes += len(data.encode('utf-8')) - previous_size
+			if self.total_bytes > self.max_bytes:
+				self.evict()
+
+	def evict(self):
+		"""
+		Deletes the least recently used entries until the cache fits in RESULT_CACHE_LOW_WATER_MARK of
+		max_bytes. Called with the lock held.
+		"""
+		target_bytes = self.max_bytes * RESULT_CACHE_LOW_WATER_MARK
+		entries = []
+		for entry_path in self.entry_paths():
+			try:
+				stat = os.stat(entry_path)
+				entries.append((stat.st_mtime, stat.st_size, entry_path))
+			except OSError:
+				pass
+		self.total_bytes = sum(size for _, size, _ in entries)
+		for _, size, entry_path in sorted(entries):
+			if self.total_bytes <= target_bytes:
+				break
+			try:
+				os.unlink(entry_path)
+				self.total_bytes -= size
+			except OSError:
+				pass
+
+	def stats(self) -> Dict[str, Any]:
+		with self.lock:
+			return {
+				'path': self.path,
+				'entries': len(self.entry_paths()),
+				'total_bytes': self.total_bytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses
+			}
+
+# Default location of the ResponseCache
+DEFAULT_RESPONSE_CACHE_PATH = ".response_cache.sqlite3"
+
+class ResponseCache:
+	"""
+	Persistent store of model responses, so that re-generating a problem set only queries the model for prompts
+	it has not answered before.
+	Responses are keyed by the model identifier, the sampling parameters and the prompt text, and are kept in a
+	single SQLite file at path.
+	"""
+	def __init__(self, path: str = DEFAULT_RESPONSE_CACHE_PATH):
+		self.path = path
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+		pathlib.Path(os.path.dirname(path) or '.').mkdir(parents=True, exist_ok=True)
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		with self.connection:
+			self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model_identifier TEXT, response TEXT)")
+	
+	def key(self, model_identifier: str, sampling_parameters: dict, prompt: str) -> str:
+		return hash_text(json.dumps([
+			model_identifier,
+			sampling_parameters,
+			hash_text(prompt)
+		], sort_keys=True))
+	
+	def get(self, model_identifier: str, sampling_parameters: dict, prompt: str) -> Optional[str]:
+		key = self.key(model_identifier, sampling_parameters, prompt)
+		with self.lock:
+			row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			return row[0]
+	
+	def put(self, model_identifier: str, sampling_parameters: dict, prompt: str, response: str):
+		key = self.key(model_identifier, sampling_parameters, prompt)
+		with self.lock, self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, model_identifier, response))
+	
+	def stats(self) -> Dict[str, Any]:
+		with self.lock:
+			entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+			return {
+				'path': self.path,
+				'entries': entries,
+				'total_bytes': os.path.getsize(self.path),
+				'hits': self.hits,
+				'misses': self.misses
+			}
+	
+	def close(self):
+		with self.lock:
+			self.connection.close()
@@ -1,12 +1,26 @@
 import sys
 import os
+import builtins
+import errno
+import math
+import signal
 from base_types import FunctionPrototype
 from typing import *
 import traceback
 import tempfile
 import multiprocessing
+import multiprocessing.connection
+import threading
+import atexit
 import json
 import time
+import random
+import copy
+import base64
+import cProfile
+import marshal
+import pstats
+import statistics
 import tracemalloc
 
 # The resource module isn't available on Windows
@@ -16,10 +30,98 @@ try:
 except ImportError:
 	USE_RESOURCE = False
 
+# Wall-clock limit, in seconds, for a single call to the executor
+DEFAULT_TIMEOUT = 5
+
+# Limits on what a single test case may use while it runs, applied in the executor process with setrlimit.
+# timeout and cpu_time are in seconds, memory (address space), file_size and output_size (the encoded
+# result) in bytes, and processes counts every process and thread of the user. A limit of None is not enforced.
+DEFAULT_LIMITS = {
+	'timeout': DEFAULT_TIMEOUT,
+	'cpu_time': 30,
+	'memory': 4 * 1024 * 1024 * 1024,
+	'processes': None,
+	'file_size': 16 * 1024 * 1024,
+	'output_size': 16 * 1024 * 1024
+}
+
+# Descriptions of the limits, used in error messages
+LIMIT_DESCRIPTIONS = {
+	'timeout': 'time limit of {} seconds',
+	'cpu_time': 'CPU time limit of {} seconds',
+	'memory': 'memory limit of {} bytes',
+	'processes': 'process limit of {}',
+	'file_size': 'file size limit of {} bytes',
+	'output_size': 'output size limit of {} bytes'
+}
+
+if USE_RESOURCE:
+	LIMIT_RESOURCES = {
+		'cpu_time': resource.RLIMIT_CPU,
+		'memory': resource.RLIMIT_AS,
+		'processes': resource.RLIMIT_NPROC,
+		'file_size': resource.RLIMIT_FSIZE
+	}
+else:
+	LIMIT_RESOURCES = {}
+
+# Number of jobs a pool worker runs before it is replaced by a fresh process
+DEFAULT_MAX_JOBS_PER_WORKER = 100
+
+# Settings for timed runs: at least min_time seconds per measured round, up to repeat rounds,
+# with fewer rounds if that would take more than max_time seconds
+DEFAULT_TIMING = {'repeat': 5, 'min_time': 0.05, 'max_time': 2}
+# Share of a case's timeout that timing it may take
+TIMING_BUDGET_SHARE = 0.8
+
+# Settings for stress runs, which call a function from many threads at once to expose races and deadlocks:
+# - threads: the thread counts that throughput is measured at; contention rounds use the largest
+# - round_time: seconds of calls each thread makes per round, judged from a single call
+# - max_calls: upper bound on the calls each thread makes per round
+# - rounds, max_time: up to rounds contention rounds, with fewer if they would take more than max_time seconds
+# - switch_interval: range that sys.setswitchinterval is drawn from, log-uniformly, for each contention round
+# - yield_probability: chance of yielding the GIL at each line of the function in every other contention round
+# - deadlock_timeout: seconds without any call completing, on top of the time the threads take to make one call
+#   each with yields injected, after which the threads of a round that have not finished are deemed deadlocked
+DEFAULT_STRESS = {
+	'threads': [1, 2, 4, 8],
+	'round_time': 0.01,
+	'max_calls': 50,
+	'rounds': 10,
+	'max_time': 2,
+	'switch_interval': [1e-6, 1e-3],
+	'yield_probability': 0.05,
+	'deadlock_timeout': 2
+}
+
+# Ways of measuring peak memory when collect_memory_usage is set:
+# - tracemalloc: Python allocations only, traced at a large slowdown; deterministic
+# - rss: the process' resident set high-water mark, with each case run in a fresh worker; includes memory
+#   allocated by C extensions, at page granularity
+# - sampling: the resident set size sampled by a background thread while the function runs, in a warm worker
+MEMORY_BACKENDS = ['tracemalloc', 'rss', 'sampling']
+DEFAULT_MEMORY_BACKEND = 'tracemalloc'
+
+# Interval, in seconds, between resident set size samples of the sampling memory backend
+MEMORY_SAMPLING_INTERVAL = 0.001
+
+# Ways execute_function can hand the job to its child process and read back the result
+TRANSPORTS = ['pipe', 'file']
+DEFAULT_TRANSPORT = 'pipe'
+
 class FunctionExecutionResult:
-	def __init__(self, result=None, cpu_time=None, peak_memory=None, error=None, traceback=None, function_code=None, parameters=None):
+	def __init__(self, result=None, cpu_time=None, peak_memory=None, error=None, traceback=None, function_code=None, parameters=None, timing=None, limit_exceeded=None, memory_backend=None, stress=None, profile=None):
 		self.result = result
+		# cProfile statistics of the measured calls, encoded by encode_profile, when profiling was requested
+		self.profile = profile
+		# Statistics of a stress run, see stress_function
+		self.stress = stress
+		# Entry of MEMORY_BACKENDS that measured peak_memory
+		self.memory_backend = memory_backend
+		# Name of the entry of DEFAULT_LIMITS that stopped the function, if any
+		self.limit_exceeded = limit_exceeded
 		self.cpu_time = cpu_time
+		self.timing = timing
 		self.peak_memory = peak_memory
 		self.error = error
 		self.traceback = traceback
@@ -27,53 +129,259 @@ class FunctionExecutionResult:
 		self.parameters = parameters
 	
 	def __repr__(self):
-		return f"<FunctionExecutionResult result={self.result} cpu_time={self.cpu_time} peak_memory={self.peak_memory} error={self.error}>"
+		return f"<FunctionExecutionResult result={self.result} cpu_time={self.cpu_time} peak_memory={self.peak_memory} error={self.error} limit_exceeded={self.limit_exceeded}>"
 
-def executor_script(function_code_file, parameters_file, config_file, result_file):
+def limit_error(name, limits):
+	"""
+	Returns an executor output dictionary reporting that the named limit was exceeded.
+	"""
+	description = LIMIT_DESCRIPTIONS[name].format(limits.get(name))
+	return {'result': None, 'error': f"Function execution exceeded the {description}.", 'limit_exceeded': name}
+
+def describe_limit_exceeded(output, limits):
+	"""
+	Prefixes the error of an output that failed because of a limit with a description of that limit.
+	"""
+	if output.get('limit_exceeded'):
+		description = limit_error(output['limit_exceeded'], limits)['error']
+		output = dict(output, error=f"{description} {output.get('error') or ''}".strip())
+	return output
+
+def limit_exceeded_by(exception):
+	"""
+	Returns the name of the limit that caused exception to be raised, or None.
+	"""
+	if isinstance(exception, MemoryError):
+		return 'memory'
+	if isinstance(exception, OSError) and exception.errno == errno.EFBIG:
+		return 'file_size'
+	if isinstance(exception, BlockingIOError) or (isinstance(exception, OSError) and exception.errno == errno.EAGAIN):
+		return 'processes'
+	if isinstance(exception, RuntimeError) and "can't start new thread" in str(exception):
+		return 'processes'
+	return None
+
+def set_soft_limit(name, value):
+	"""
+	Sets the soft limit of a resource, capped at its hard limit, and returns the previous soft limit.
+	"""
+	resource_id = LIMIT_RESOURCES[name]
+	soft, hard = resource.getrlimit(resource_id)
+	if value is None:
+		value = hard
+	elif hard != resource.RLIM_INFINITY:
+		value = min(value, hard)
 	try:
-		# Load the function code
-		with open(function_code_file, 'r') as file:
-			function_code = file.read()
+		resource.setrlimit(resource_id, (value, hard))
+	except (ValueError, OSError):
+		pass
+	return soft
+
+def apply_limits(limits):
+	"""
+	Lowers the soft limits of the current process to limits, except for cpu_time, which is set before each case
+	by apply_cpu_time_limit. Returns the previous soft limits, to be passed to restore_limits.
+	"""
+	previous = {}
+	for name in LIMIT_RESOURCES:
+		if name != 'cpu_time' and limits.get(name) is not None:
+			previous[name] = set_soft_limit(name, limits[name])
+	return previous
+
+def apply_cpu_time_limit(limits):
+	"""
+	Allows the current process limits['cpu_time'] more seconds of CPU time. Exceeding it kills the process with
+	SIGXCPU, which the pool reports as a cpu_time limit.
+	"""
+	if 'cpu_time' not in LIMIT_RESOURCES:
+		return None
+	cpu_time = limits.get('cpu_time')
+	if cpu_time is None:
+		return set_soft_limit('cpu_time', None)
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return set_soft_limit('cpu_time', math.ceil(usage.ru_utime + usage.ru_stime + cpu_time))
+
+def restore_limits(previous):
+	for name, soft in previous.items():
+		set_soft_limit(name, soft)
+
+def define_function(function_code):
+	"""
+	Executes function_code and returns the last function it defines.
+	"""
+	# Add necessary imports
+	function_code = f"from typing import *\n\n{function_code}"
 	
-		# Load the parameters
-		with open(parameters_file, 'r') as file:
-			parameters = json.load(file)
+	# Execute the function code to define the function(s)
+	exec_globals = {}
+	exec(compile(function_code, '<string>', 'exec'), exec_globals)
 	
-		# Load the configuration
-		with open(config_file, 'r') as file:
-			config = json.load(file)
+	# Get the name of the last defined function
+	last_function_name = [name for name in exec_globals if callable(exec_globals[name])][-1]
+	return exec_globals[last_function_name]
+
+def max_rss():
+	"""
+	Returns the resident set size high-water mark of the current process, in bytes.
+	"""
+	usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS bytes
+	return usage if sys.platform == 'darwin' else usage * 1024
+
+def current_rss():
+	"""
+	Returns the current resident set size of the current process, in bytes, or the high-water mark where the
+	current size is not available.
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, IndexError):
+		return max_rss()
+
+class MemorySampler:
+	"""
+	Samples the resident set size of the current process on a background thread, keeping the largest sample.
+	"""
+	def __init__(self, interval=MEMORY_SAMPLING_INTERVAL):
+		self.interval = interval
+		self.peak = current_rss()
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.sample, daemon=True)
 	
+	def sample(self):
+		while not self.stopped.wait(self.interval):
+			self.peak = max(self.peak, current_rss())
+	
+	def __enter__(self):
+		self.thread.start()
+		self.peak = current_rss()
+		return self
+	
+	def __exit__(self, *args):
+		self.stopped.set()
+		self.thread.join()
+		self.peak = max(self.peak, current_rss())
+
+def encode_profile(profiler):
+	"""
+	Encodes the statistics of a cProfile.Profile as base64 text, in the marshal format of pstats' .prof files.
+	"""
+	profiler.create_stats()
+	return base64.b64encode(marshal.dumps(profiler.stats)).decode('ascii')
+
+def decode_profile(profile):
+	return marshal.loads(base64.b64decode(profile))
+
+def merge_profiles(profiles):
+	"""
+	Combines encoded profiles into one, adding up the statistics of functions that appear in several.
+	"""
+	merged = {}
+	for profile in profiles:
+		for function, function_stats in decode_profile(profile).items():
+			merged[function] = pstats.add_func_stats(merged[function], function_stats) if function in merged else function_stats
+	return base64.b64encode(marshal.dumps(merged)).decode('ascii')
+
+def hot_functions(profile, count=5):
+	"""
+	Returns the count functions of an encoded profile that spent the most time in their own code, as dictionaries
+	holding their description, number of calls, own time and cumulative time in seconds. The profiler's own
+	methods, such as the call that disables it, are left out.
+	"""
+	stats = {function: function_stats for function, function_stats in decode_profile(profile).items()
+		if '_lsprof.Profiler' not in function[2]}
+	hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:count]
+	return [{
+		'function': pstats.func_std_string(function),
+		'calls': calls,
+		'own_time': own_time,
+		'cumulative_time': cumulative_time
+	} for function, (primitive_calls, calls, own_time, cumulative_time, callers) in hottest]
+
+def profile_calls(function, parameters, number):
+	"""
+	Calls an already defined function number times under cProfile and returns the encoded profile. A call that
+	raises ends the profile there, so that failing functions are profiled up to the point where they fail.
+	"""
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		for i in range(number):
+			function(*parameters)
+	except Exception:
+		pass
+	finally:
+		profiler.disable()
+	return encode_profile(profiler)
+
+def call_function(function, parameters, config):
+	"""
+	Calls an already defined function with parameters in the current process.
+	Returns a dictionary holding the result and any collected metrics, or the error raised along the way.
+	If config['profile'] is set, the measured calls are profiled with cProfile, and the metrics, including those
+	of a call that raised, hold the encoded profile.
+	"""
+	profiler = cProfile.Profile() if config.get('profile') else None
+	try:
 		# Set default configurations if not provided
 		iterations = config.get('iterations', 1)
 		collect_cpu_time = config.get('collect_cpu_time', False)
 		collect_memory_usage = config.get('collect_memory_usage', False)
 	
-		# Add necessary imports
-		function_code = f"from typing import *\n\n{function_code}"
+		if config.get('timing') is not None:
+			# Leave part of the case's timeout for the worker's own overhead, and for the profiled round if any
+			timeout = (config.get('limits') or {}).get('timeout')
+			budget = timeout * TIMING_BUDGET_SHARE / (2 if config.get('profile') else 1) if timeout else None
+			result, timing = time_function(function, parameters, config['timing'], budget)
+			metrics = {'cpu_time': timing['cpu_time_median'], 'timing': timing}
+			# Profile a round of calls of its own, so that the profiler does not slow down the timed rounds
+			if config.get('profile'):
+				metrics['profile'] = profile_calls(function, parameters, timing['number'])
+			return {'result': result, 'metrics': metrics}
 	
-		# Execute the function code to define the function(s)
-		exec_globals = {}
-		exec(function_code, exec_globals)
+		if config.get('stress') is not None:
+			result, stress = stress_function(function, parameters, config['stress'])
+			return {'result': result, 'metrics': {'stress': stress}}
 	
-		# Get the name of the last defined function
-		last_function_name = [name for name in exec_globals if callable(exec_globals[name])][-1]
-		function = exec_globals[last_function_name]
+		memory_backend = config.get('memory_backend') or DEFAULT_MEMORY_BACKEND
+		if memory_backend != 'tracemalloc' and not USE_RESOURCE:
+			memory_backend = 'tracemalloc'
 	
 		# Initialize metrics
 		total_time = 0
 		peak_memory = 0
+		if collect_memory_usage and memory_backend == 'tracemalloc':
+			tracemalloc.start()
 	
 		# Execute function for specified iterations and collect metrics
 		for i in range(iterations):
 			if collect_memory_usage:
-				tracemalloc.start()
+				sampler = MemorySampler() if memory_backend == 'sampling' else None
+				if sampler is not None:
+					sampler.__enter__()
+				# Measure from the memory in use before the call, so that earlier results and the sampler's own
+				# thread are not counted
+				if memory_backend == 'tracemalloc':
+					tracemalloc.reset_peak()
+					memory_before, _ = tracemalloc.get_traced_memory()
+				else:
+					memory_before = current_rss()
 	
 			if collect_cpu_time:
 				if USE_RESOURCE:
 					start_time = resource.getrusage(resource.RUSAGE_SELF).ru_utime + resource.getrusage(resource.RUSAGE_SELF).ru_stime
 				else:
 					start_time = time.time()
-			result = function(*parameters)
+			try:
+				if profiler is not None:
+					profiler.enable()
+				result = function(*parameters)
+			finally:
+				if profiler is not None:
+					profiler.disable()
+				if collect_memory_usage and sampler is not None:
+					sampler.__exit__()
 			if collect_cpu_time:
 				if USE_RESOURCE:
 					end_time = (resource.getrusage(resource.RUSAGE_SELF).ru_utime + resource.getrusage(resource.RUSAGE_SELF).ru_stime)
@@ -83,34 +391,658 @@ def executor_script(function_code_file, parameters_file, config_file, result_fil
 				total_time += (end_time - start_time)
 	
 			if collect_memory_usage:
-				_, max_mem = tracemalloc.get_traced_memory()
-				peak_memory = max(peak_memory, max_mem)
-				tracemalloc.stop()
+				if memory_backend == 'tracemalloc':
+					_, max_mem = tracemalloc.get_traced_memory()
+				elif memory_backend == 'rss':
+					max_mem = max_rss()
+				else:
+					max_mem = sampler.peak
+				peak_memory = max(peak_memory, max_mem - memory_before)
+	
+		if tracemalloc.is_tracing():
+			tracemalloc.stop()
 	
 		metrics = {}
 		if collect_cpu_time:
 			metrics['cpu_time'] = total_time
 		if collect_memory_usage:
 			metrics['peak_memory'] = peak_memory
+			metrics['memory_backend'] = memory_backend
+		if profiler is not None:
+			metrics['profile'] = encode_profile(profiler)
+	
+		return {'result': result, 'metrics': metrics}
+	
+	except Exception as e:
+		if tracemalloc.is_tracing():
+			tracemalloc.stop()
+		output = {'result': None, 'error': str(e), 'traceback': traceback.format_exc()}
+		limit_exceeded = limit_exceeded_by(e)
+		if limit_exceeded is not None:
+			output['limit_exceeded'] = limit_exceeded
+		if profiler is not None and limit_exceeded is None:
+			# Timed calls are not profiled while they run, so profile the failing call once more
+			output['metrics'] = {'profile': profile_calls(function, parameters, 1) if config.get('timing') is not None else encode_profile(profiler)}
+		return output
+
+def time_function(function, parameters, timing, budget=None):
+	"""
+	Times an already defined function the way timeit.autorange does, inside the current process.
+	After a timed warm-up call, the number of calls per round grows (1, 2, 5, 10, 20, ...) until a round takes at
+	least timing['min_time'] seconds, then up to timing['repeat'] rounds are measured with perf_counter_ns and
+	process_time_ns. Returns the result of the warm-up call and the median and spread of the per-call times.
+	With a budget, in seconds, no round is started that is expected to end after it: calibration stops at the
+	last round that fits, and a function whose warm-up call leaves no room for another is timed by that call alone.
+	"""
+	repeat = timing.get('repeat', DEFAULT_TIMING['repeat'])
+	min_time = timing.get('min_time', DEFAULT_TIMING['min_time'])
+	max_time = timing.get('max_time', DEFAULT_TIMING['max_time'])
+	deadline = time.perf_counter() + budget if budget is not None else math.inf
+	
+	def measure(number):
+		wall_start = time.perf_counter_ns()
+		cpu_start = time.process_time_ns()
+		for i in range(number):
+			result = function(*parameters)
+		cpu_end = time.process_time_ns()
+		wall_end = time.perf_counter_ns()
+		return (wall_end - wall_start) / 1e9, (cpu_end - cpu_start) / 1e9, result
+	
+	def fits(seconds):
+		return time.perf_counter() + seconds <= deadline
+	
+	*warm_up, result = measure(1)
+	number = 1
+	rounds = [tuple(warm_up)]
+	if fits(warm_up[0]):
+		steps = 0
+		rounds = [measure(number)[:2]]
+		while rounds[0][0] < min_time:
+			next_number = number * 5 // 2 if steps % 3 == 1 else number * 2
+			if not fits(rounds[0][0] / number * next_number):
+				break
+			number = next_number
+			steps += 1
+			rounds = [measure(number)[:2]]
+		
+		# The calibration round is the first measured round
+		repeat = max(1, min(repeat, int(max_time / max(rounds[0][0], 1e-9))))
+		while len(rounds) < repeat and fits(rounds[0][0]):
+			rounds.append(measure(number)[:2])
+	
+	wall_times = [wall / number for wall, cpu in rounds]
+	cpu_times = [cpu / number for wall, cpu in rounds]
+	return result, {
+		'number': number,
+		'repeat': len(rounds),
+		'wall_time_median': statistics.median(wall_times),
+		'wall_time_stdev': statistics.stdev(wall_times) if len(wall_times) > 1 else 0,
+		'cpu_time_median': statistics.median(cpu_times),
+		'cpu_time_stdev': statistics.stdev(cpu_times) if len(cpu_times) > 1 else 0
+	}
+
+def canonical_result(result):
+	"""
+	Returns a string that equal results map to, for comparing results across threads.
+	"""
+	try:
+		return json.dumps(result, sort_keys=True, default=repr)
+	except Exception:
+		return repr(result)
+
+def yield_tracer(probability):
+	"""
+	Returns a trace function that yields the GIL at random lines of the code being graded, so that threads switch
+	in places they rarely would otherwise.
+	"""
+	def trace(frame, event, arg):
+		if frame.f_code.co_filename != '<string>':
+			return None
+		if event == 'line' and random.random() < probability:
+			time.sleep(0)
+		return trace
+	return trace
+
+def stress_round(function, parameters, thread_count, calls, stall_timeout, tracer=None):
+	"""
+	Starts thread_count threads that each call the function calls times, released together by a barrier, and
+	waits for them for as long as they keep completing calls. Returns the canonical results of every call, with
+	the calls that raised as ('error', description) pairs, the seconds between the first thread starting its
+	calls and the last one finishing, and whether the threads were deadlocked: still running although none of
+	them completed a call for stall_timeout seconds.
+	"""
+	# Each call gets its own copy of the parameters, so that only state the function shares can diverge
+	arguments = [[copy.deepcopy(parameters) for i in range(calls)] for t in range(thread_count)]
+	results = [[] for t in range(thread_count)]
+	spans = [None] * thread_count
+	barrier = threading.Barrier(thread_count)
+	
+	def run(index):
+		try:
+			barrier.wait(stall_timeout)
+		except threading.BrokenBarrierError:
+			return
+		start = time.perf_counter()
+		for call_parameters in arguments[index]:
+			try:
+				results[index].append(canonical_result(function(*call_parameters)))
+			except Exception as e:
+				results[index].append(('error', f"{type(e).__name__}: {e}"))
+		spans[index] = (start, time.perf_counter())
+	
+	if tracer is not None:
+		threading.settrace(tracer)
+	try:
+		threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(thread_count)]
+		for thread in threads:
+			thread.start()
+	finally:
+		threading.settrace(None)
+	# The number of calls completed so far serves as a progress counter; the deadline moves with every call
+	completed = 0
+	deadline = time.perf_counter() + stall_timeout
+	deadlocked = False
+	for thread in threads:
+		while thread.is_alive():
+			thread.join(min(0.05, max(0, deadline - time.perf_counter())))
+			progress = sum(len(thread_results) for thread_results in results)
+			if progress > completed:
+				completed = progress
+				deadline = time.perf_counter() + stall_timeout
+			elif thread.is_alive() and time.perf_counter() >= deadline:
+				deadlocked = True
+				break
+		if deadlocked:
+			break
+	
+	finished = [span for span in spans if span is not None]
+	wall_time = max(end for start, end in finished) - min(start for start, end in finished) if finished else None
+	return [result for thread_results in results for result in thread_results], wall_time, deadlocked
+
+def stress_function(function, parameters, stress):
+	"""
+	Calls an already defined function from many threads at once, inside the current process.
+	The function is first called twice from a single thread, then once more with yields injected; if the first
+	two results differ, it is nondeterministic and only calls that raise count as divergent. Throughput is then
+	measured at every thread count in stress['threads'], followed by contention rounds at the largest count,
+	each under a random switch interval and every other one with yields injected into the function. Every round
+	is counted, and a round diverges when any call returns something other than the single-threaded result or
+	raises. A round is deadlocked when no call completes for stress['deadlock_timeout'] seconds plus the time
+	all its threads would take to make one call each with yields injected. Stops at the first deadlocked round.
+	Returns the result of the first call and the statistics of the run.
+	"""
+	settings = dict(DEFAULT_STRESS, **stress)
+	thread_counts = sorted(settings['threads'])
+	
+	start = time.perf_counter()
+	result = function(*copy.deepcopy(parameters))
+	call_time = time.perf_counter() - start
+	reference = canonical_result(result)
+	deterministic = canonical_result(function(*copy.deepcopy(parameters))) == reference
+	calls = max(1, min(settings['max_calls'], int(settings['round_time'] / max(call_time, 1e-9))))
+	
+	# Injected yields slow every line of the function, so the call that sets the stall timeout is traced too
+	sys.settrace(yield_tracer(settings['yield_probability']))
+	start = time.perf_counter()
+	try:
+		function(*copy.deepcopy(parameters))
+	except Exception:
+		pass
+	finally:
+		sys.settrace(None)
+	traced_call_time = max(call_time, time.perf_counter() - start)
+	stall_timeout = settings['deadlock_timeout'] + 2 * traced_call_time * thread_counts[-1]
+	
+	report = {
+		'calls_per_thread': calls,
+		'deterministic': deterministic,
+		'throughput': {},
+		'rounds': 0,
+		'diverged_rounds': 0,
+		'divergent_results': [],
+		'deadlocked': False
+	}
+	
+	def check(results):
+		divergent = [r for r in results if (r != reference if deterministic else isinstance(r, tuple))]
+		if divergent:
+			report['diverged_rounds'] += 1
+			if len(report['divergent_results']) < 3:
+				report['divergent_results'].append(divergent[0])
+	
+	previous_interval = sys.getswitchinterval()
+	try:
+		# Throughput as threads are added, under the default switch interval and without injected yields
+		for thread_count in thread_counts:
+			results, wall_time, deadlocked = stress_round(function, parameters, thread_count, calls, stall_timeout)
+			report['rounds'] += 1
+			if deadlocked:
+				report['deadlocked'] = True
+				return result, report
+			check(results)
+			report['throughput'][str(thread_count)] = thread_count * calls / max(wall_time, 1e-9)
+	
+		low, high = settings['switch_interval']
+		contention_start = time.perf_counter()
+		for round_index in range(settings['rounds']):
+			if time.perf_counter() - contention_start > settings['max_time']:
+				break
+			sys.setswitchinterval(math.exp(random.uniform(math.log(low), math.log(high))))
+			tracer = yield_tracer(settings['yield_probability']) if round_index % 2 == 1 else None
+			results, wall_time, deadlocked = stress_round(function, parameters, thread_counts[-1], calls, stall_timeout, tracer)
+			report['rounds'] += 1
+			if deadlocked:
+				report['deadlocked'] = True
+				break
+			check(results)
+	finally:
+		sys.setswitchinterval(previous_interval)
+	return result, report
+
+def run_function_code(function_code, parameters, config):
+	"""
+	Defines the last function in function_code and calls it with parameters in the current process.
+	Returns a dictionary holding the result and any collected metrics, or the error raised along the way.
+	"""
+	try:
+		function = define_function(function_code)
+	except Exception as e:
+		return {'result': None, 'error': str(e), 'traceback': traceback.format_exc()}
+	return call_function(function, parameters, config)
+
+def encode_output(output, limits=None):
+	"""
+	Serializes an executor output dictionary to JSON, reporting results that cannot be serialized, or that are
+	larger than limits['output_size'], as errors.
+	"""
+	try:
+		encoded = json.dumps(output)
+	except Exception as e:
+		return json.dumps({'result': None, 'error': str(e), 'traceback': traceback.format_exc()})
+	output_size = (limits or {}).get('output_size')
+	if output_size is not None and len(encoded) > output_size:
+		return json.dumps(limit_error('output_size', limits))
+	return encoded
+
+def prepare_executor_process():
+	"""
+	Makes writes beyond the file size limit raise an OSError in the executor instead of killing it.
+	"""
+	if USE_RESOURCE:
+		signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+
+def executor_script(function_code_file, parameters_file, config_file, result_file):
+	try:
+		# Load the function code
+		with open(function_code_file, 'r') as file:
+			function_code = file.read()
+	
+		# Load the parameters
+		with open(parameters_file, 'r') as file:
+			parameters = json.load(file)
+	
+		# Load the configuration
+		with open(config_file, 'r') as file:
+			config = json.load(file)
+	
+		limits = config.get('limits') or {}
+		prepare_executor_process()
+		previous_limits = apply_limits(limits)
+		apply_cpu_time_limit(limits)
+		try:
+			output = describe_limit_exceeded(run_function_code(function_code, parameters, config), limits)
+		finally:
+			restore_limits(previous_limits)
 	
 		# Write the result and metrics to the result file
-		output = {'result': result, 'metrics': metrics}
 		with open(result_file, 'w') as file:
-			json.dump(output, file)
+			file.write(encode_output(output, limits))
 	
 	except Exception as e:
 		# Write any exception to the result file as a dictionary
 		with open(result_file, 'w') as file:
 			json.dump({'result': None, 'error': str(e), 'traceback': traceback.format_exc()}, file)
+
+def interpreter_state():
+	"""
+	Captures the parts of the interpreter that code under test can change for the code run after it: the
+	builtins, the loaded modules, the import path and the working directory.
+	"""
+	return {
+		'builtins': dict(vars(builtins)),
+		'modules': dict(sys.modules),
+		'path': list(sys.path),
+		'cwd': os.getcwd()
+	}
+
+def interpreter_changed(snapshot):
+	"""
+	Returns whether the interpreter differs from a snapshot taken by interpreter_state, or has threads other than
+	the main thread still running. Modules imported since the snapshot do not count, as most solutions import
+	some; modules that were replaced or removed do.
+	"""
+	if threading.active_count() > 1:
+		return True
+	state = interpreter_state()
+	if state['builtins'].keys() != snapshot['builtins'].keys():
+		return True
+	for name in ('builtins', 'modules'):
+		if any(state[name].get(key) is not value for key, value in snapshot[name].items()):
+			return True
+	return state['path'] != snapshot['path'] or state['cwd'] != snapshot['cwd']
+
+def pool_worker_script(connection):
+	"""
+	Entry point of a pool worker process. Serves JSON-encoded jobs received over connection, one at a time,
+	until it receives an empty message or its parent process exits.
+	A job holds one piece of code and a list of parameter lists to call it with. After the outputs of a job, the
+	worker reports whether the job changed its interpreter (see interpreter_changed); if it did, the worker exits,
+	so that the next job starts from a clean process.
+	"""
+	parent_pid = os.getppid()
+	prepare_executor_process()
+	snapshot = interpreter_state()
+	while True:
+		try:
+			while not connection.poll(1):
+				if os.getppid() != parent_pid:
+					return
+			message = connection.recv_bytes()
+		except (EOFError, OSError):
+			return
+		if not message:
+			return
 	
+		# Define the function once, then stream back one output per set of parameters, all under the job's limits
+		job = json.loads(message)
+		limits = job['config'].get('limits') or {}
+		previous_limits = apply_limits(limits)
+		previous_cpu_time_limit = apply_cpu_time_limit(limits)
+		try:
+			try:
+				function = define_function(job['function_code'])
+				definition_error = None
+			except Exception as e:
+				definition_error = {'result': None, 'error': str(e), 'traceback': traceback.format_exc()}
+		
+			for parameters in job['parameter_lists']:
+				apply_cpu_time_limit(limits)
+				output = describe_limit_exceeded(definition_error or call_function(function, parameters, job['config']), limits)
+				connection.send_bytes(encode_output(output, limits).encode())
+		finally:
+			restore_limits(previous_limits)
+			if previous_cpu_time_limit is not None:
+				set_soft_limit('cpu_time', previous_cpu_time_limit)
+		
+		function = None
+		recycle = interpreter_changed(snapshot)
+		connection.send_bytes(json.dumps({'recycle': recycle}).encode())
+		if recycle:
+			return
+
+def output_to_result(output, function_code, parameters):
+	"""
+	Constructs a FunctionExecutionResult from an executor output dictionary.
+	"""
+	metrics = output.get('metrics', {})
+	return FunctionExecutionResult(
+		result=output.get('result'),
+		cpu_time=metrics.get('cpu_time'),
+		peak_memory=metrics.get('peak_memory'),
+		error=output.get('error'),
+		traceback=output.get('traceback'),
+		function_code=function_code,
+		parameters=parameters,
+		timing=metrics.get('timing'),
+		limit_exceeded=output.get('limit_exceeded'),
+		memory_backend=metrics.get('memory_backend'),
+		stress=metrics.get('stress'),
+		profile=metrics.get('profile')
+	)
+
+# Held while creating worker processes so that a forked child never inherits the pipe of another worker
+_spawn_lock = threading.Lock()
 
-def execute_function(function_code, parameters, iterations, collect_cpu_time, collect_memory_usage):
+class PoolWorker:
+	"""
+	A long-lived executor process that receives jobs over a pipe.
+	"""
+	def __init__(self):
+		with _spawn_lock:
+			self.connection, child_connection = multiprocessing.Pipe()
+			self.process = multiprocessing.Process(target=pool_worker_script, args=(child_connection,))
+			self.process.start()
+			child_connection.close()
+		self.jobs_run = 0
+		self.alive = True
+	
+	def run(self, job, timeout):
+		"""
+		Sends a job to the worker and collects one output dictionary per parameter list, waiting up to timeout
+		seconds for each. A worker whose interpreter the job changed is retired afterwards. If the worker times
+		out, crashes or is killed for exceeding its CPU time limit, it is killed, an error output is recorded for
+		the case it was running and the outputs gathered so far are returned.
+		"""
+		limits = dict(job['config'].get('limits') or {}, timeout=timeout)
+		self.jobs_run += 1
+		outputs = []
+		ready = []
+		try:
+			self.connection.send_bytes(json.dumps(job).encode())
+			while len(outputs) < len(job['parameter_lists']):
+				ready = multiprocessing.connection.wait([self.connection, self.process.sentinel], timeout)
+				if not self.connection.poll():
+					break
+				outputs.append(json.loads(self.connection.recv_bytes()))
+			else:
+				# The worker then reports whether the job left it fit for another one
+				if not (self.connection.poll(timeout) and not json.loads(self.connection.recv_bytes())['recycle']):
+					self.kill()
+				return outputs
+		except (EOFError, OSError):
+			pass
+	
+		if not ready:
+			self.kill()
+			outputs.append(dict(limit_error('timeout', limits), error=f"Function execution timed out after {timeout} seconds."))
+			return outputs
+		self.process.join(timeout=1)
+		self.kill()
+		if USE_RESOURCE and self.process.exitcode == -signal.SIGXCPU:
+			outputs.append(limit_error('cpu_time', limits))
+		else:
+			outputs.append({'result': None, 'error': f"Function execution crashed with exit code {self.process.exitcode}."})
+		return outputs
+	
+	def stop(self):
+		"""
+		Asks the worker to exit, killing it if it does not do so promptly.
+		"""
+		if self.alive:
+			try:
+				self.connection.send_bytes(b'')
+			except OSError:
+				pass
+			self.process.join(timeout=1)
+		self.kill()
+	
+	def kill(self):
+		self.alive = False
+		if self.process.is_alive():
+			self.process.terminate()
+			self.process.join(timeout=1)
+			if self.process.is_alive():
+				self.process.kill()
+				self.process.join()
+		self.connection.close()
+
+class WorkerPool:
+	"""
+	A pool of sandboxed executor processes that stay alive between calls.
+	Each worker runs many jobs and is replaced after max_jobs_per_worker jobs, a crash or a timeout.
+	Jobs run under the pool's limits (see DEFAULT_LIMITS), which each call can override; timeout sets the
+	pool's time limit. Calls are thread-safe; at most size jobs run at once.
+	"""
+	def __init__(self, size=1, max_jobs_per_worker=DEFAULT_MAX_JOBS_PER_WORKER, timeout=DEFAULT_TIMEOUT, limits=None):
+		self.size = size
+		self.max_jobs_per_worker = max_jobs_per_worker
+		# A timeout among limits takes precedence over the timeout argument
+		self.limits = dict(DEFAULT_LIMITS, timeout=timeout)
+		self.limits.update(limits or {})
+		self.timeout = self.limits['timeout']
+		self.idle_workers = []
+		self.slots = threading.Semaphore(size)
+		self.lock = threading.Lock()
+		self.closed = False
+	
+	def acquire_worker(self, fresh=False):
+		"""
+		Returns an idle worker, or a new one if there is none or fresh is set.
+		"""
+		self.slots.acquire()
+		with self.lock:
+			if self.idle_workers and not fresh:
+				return self.idle_workers.pop()
+		try:
+			return PoolWorker()
+		except Exception:
+			self.slots.release()
+			raise
+	
+	def release_worker(self, worker, reuse=True):
+		with self.lock:
+			if reuse and worker.alive and worker.jobs_run < self.max_jobs_per_worker and not self.closed:
+				self.idle_workers.append(worker)
+				worker = None
+		if worker is not None:
+			worker.stop()
+		self.slots.release()
+	
+	def execute_function(self, function_code, parameters, iterations=1, collect_cpu_time=False, collect_memory_usage=False, timing=None, limits=None, memory_backend=DEFAULT_MEMORY_BACKEND):
+		return self.execute_batch(function_code, [parameters], iterations, collect_cpu_time, collect_memory_usage, timing, limits, memory_backend)[0]
+	
+	def execute_batch(self, function_code, parameter_lists, iterations=1, collect_cpu_time=False, collect_memory_usage=False, timing=None, limits=None, memory_backend=DEFAULT_MEMORY_BACKEND, stress=None, profile=False):
+		"""
+		Runs function_code against every parameter list, defining the function only once per worker.
+		Returns one FunctionExecutionResult per parameter list, in order. Each case has its own timeout and CPU
+		time limit; when a case hangs or crashes the worker, the remaining cases continue on a fresh worker.
+		If timing settings are given (see DEFAULT_TIMING), iterations and collect_* are ignored and each case is
+		timed by time_function instead.
+		limits overrides entries of the pool's limits for this call.
+		memory_backend selects how peak memory is measured (see MEMORY_BACKENDS). With the rss backend, every
+		case runs in a fresh worker of its own, since the high-water mark of a process never decreases.
+		If stress settings are given (see DEFAULT_STRESS), each case is instead stress-run by stress_function in a
+		fresh worker of its own, which is discarded afterwards along with any threads left deadlocked.
+		With profile set, each result holds a cProfile profile of its measured calls (see call_function).
+		"""
+		if memory_backend not in MEMORY_BACKENDS:
+			raise ValueError(f"Unknown memory backend '{memory_backend}'. Expected one of: {', '.join(MEMORY_BACKENDS)}")
+		limits = dict(self.limits, **(limits or {}))
+		config = {
+			"iterations": iterations,
+			"collect_cpu_time": collect_cpu_time,
+			"collect_memory_usage": collect_memory_usage,
+			"timing": timing,
+			"limits": limits,
+			"memory_backend": memory_backend,
+			"stress": stress,
+			"profile": profile
+		}
+		fresh = (collect_memory_usage and memory_backend == 'rss') or stress is not None
+		outputs = [None] * len(parameter_lists)
+		pending = []
+		for index, parameters in enumerate(parameter_lists):
+			try:
+				json.dumps(parameters)
+				pending.append(index)
+			except Exception as e:
+				outputs[index] = {'result': None, 'error': str(e)}
+	
+		while pending:
+			batch = pending[:1] if fresh else pending
+			job = {
+				"function_code": function_code,
+				"parameter_lists": [parameter_lists[index] for index in batch],
+				"config": config
+			}
+			try:
+				worker = self.acquire_worker(fresh)
+				try:
+					batch_outputs = worker.run(job, limits['timeout'])
+				finally:
+					self.release_worker(worker, reuse=not fresh)
+			except Exception as e:
+				batch_outputs = [{'result': None, 'error': str(e)}] * len(batch)
+	
+			for index, output in zip(batch, batch_outputs):
+				outputs[index] = output
+			pending = pending[len(batch_outputs):]
+	
+		return [output_to_result(output, function_code, parameters) for output, parameters in zip(outputs, parameter_lists)]
+	
+	def shutdown(self):
+		"""
+		Stops every idle worker. Workers that are busy are stopped when they are released.
+		"""
+		with self.lock:
+			self.closed = True
+			workers, self.idle_workers = self.idle_workers, []
+		for worker in workers:
+			worker.stop()
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_default_pool():
+	"""
+	Returns the shared WorkerPool, creating it on first use.
+	"""
+	global _default_pool
+	with _default_pool_lock:
+		if _default_pool is None:
+			_default_pool = WorkerPool()
+		return _default_pool
+
+def configure_default_pool(**kwargs):
+	"""
+	Replaces the shared WorkerPool with one constructed from kwargs.
+	"""
+	global _default_pool
+	with _default_pool_lock:
+		if _default_pool is not None:
+			_default_pool.shutdown()
+		_default_pool = WorkerPool(**kwargs)
+		return _default_pool
+
+@atexit.register
+def shutdown_default_pool():
+	with _default_pool_lock:
+		if _default_pool is not None:
+			_default_pool.shutdown()
+
+def execute_function(function_code, parameters, iterations, collect_cpu_time, collect_memory_usage, transport=DEFAULT_TRANSPORT, limits=None):
+	"""
+	Runs function_code against parameters in a fresh child process, under DEFAULT_LIMITS overridden by limits.
+	With the 'pipe' transport the job and result travel over a pipe; the 'file' transport hands them over
+	through temporary files instead.
+	"""
+	if transport == 'pipe':
+		return execute_batch(function_code, [parameters], iterations, collect_cpu_time, collect_memory_usage, limits=limits)[0]
+	if transport != 'file':
+		raise ValueError(f"Unknown transport '{transport}'. Expected one of: {', '.join(TRANSPORTS)}")
+	
+	limits = dict(DEFAULT_LIMITS, **(limits or {}))
+	temporary_files = []
 	try:
 		# Create temporary files for function_code, parameters, config, and result
 		function_code_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.py')
+		temporary_files.append(function_code_file)
 		parameters_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json')
+		temporary_files.append(parameters_file)
 		config_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json')
+		temporary_files.append(config_file)
 		result_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json')
+		temporary_files.append(result_file)
 		
 		# Write function_code and parameters to temporary files
 		function_code_file.write(function_code)
@@ -123,53 +1055,60 @@ def execute_function(function_code, parameters, iterations, collect_cpu_time, co
 		config_data = {
 			"iterations": iterations,
 			"collect_cpu_time": collect_cpu_time,
-			"collect_memory_usage": collect_memory_usage
+			"collect_memory_usage": collect_memory_usage,
+			"limits": limits
 		}
 		json.dump(config_data, config_file)
 		config_file.close()  # Close the file to ensure it's written to disk
+		result_file.close()
 		
 		# Create a separate Python process to run the executor_script
 		process = multiprocessing.Process(target=executor_script, args=(function_code_file.name, parameters_file.name, config_file.name, result_file.name))
 		process.start()
-		process.join(timeout=5)  # Add a timeout of 5 seconds
+		process.join(timeout=limits['timeout'])
 		
 		# If the process is still alive after the timeout, terminate it
 		if process.is_alive():
 			process.terminate()
 			return FunctionExecutionResult(
-				error="Function execution timed out after 5 seconds.",
+				error=f"Function execution timed out after {limits['timeout']} seconds.",
 				function_code=function_code,
-				parameters=parameters
+				parameters=parameters,
+				limit_exceeded='timeout'
 			)
+		if USE_RESOURCE and process.exitcode == -signal.SIGXCPU:
+			return output_to_result(limit_error('cpu_time', limits), function_code, parameters)
 		
 		# Load the result from the result file
 		with open(result_file.name, 'r') as file:
 			result_data = json.load(file)
 		
-		try:
-			# Clean up temporary files
-			os.unlink(function_code_file.name)
-			os.unlink(parameters_file.name)
-			os.unlink(config_file.name)
-			os.unlink(result_file.name)
-		except Exception as e:
-			print(f"Failed to unlink temporary files: {str(e)}")
-		
 		# Construct the result object
-		metrics = result_data.get('metrics', {})
-		return FunctionExecutionResult(
-			result=result_data.get('result'),
-			cpu_time=metrics.get('cpu_time'),
-			peak_memory=metrics.get('peak_memory'),
-			error=result_data.get('error'),
-			traceback=result_data.get('traceback'),
-			function_code=function_code,
-			parameters=parameters
-		)
+		return output_to_result(result_data, function_code, parameters)
 		
 	except Exception as e:
 		return FunctionExecutionResult(
 			error=str(e),
 			function_code=function_code,
 			parameters=parameters
-		)
\ No newline at end of file
+		)
+	
+	finally:
+		# Clean up temporary files, including those left behind by a timed out or failed child
+		for temporary_file in temporary_files:
+			try:
+				temporary_file.close()
+				os.unlink(temporary_file.name)
+			except Exception as e:
+				print(f"Failed to unlink temporary file {temporary_file.name}: {str(e)}")
+
+def execute_batch(function_code, parameter_lists, iterations=1, collect_cpu_time=False, collect_memory_usage=False, timing=None, limits=None, memory_backend=DEFAULT_MEMORY_BACKEND, stress=None, profile=False):
+	"""
+	Runs function_code against a whole list of ordered parameter lists in a single sandboxed child process.
+	Returns one FunctionExecutionResult per parameter list, in order.
+	"""
+	pool = WorkerPool()
+	try:
+		return pool.execute_batch(function_code, parameter_lists, iterations, collect_cpu_time, collect_memory_usage, timing, limits, memory_backend, stress, profile)
+	finally:
+		pool.shutdown()
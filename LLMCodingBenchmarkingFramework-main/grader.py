@@ -1,9 +1,14 @@
-import subprocess
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from base_types import *
+from typing import Tuple
+import cache
 import execution
-import time
-import tokenize
+import halstead
+import lint
+import math
+import os
+import threading
 
 
 class Grader(ABC):
@@ -20,24 +25,93 @@ class Grader(ABC):
 		"""
         pass
 
+    # Bump when a change to a grader makes the grades it produced before incomparable, invalidating cached grades
+    version = 1
+
+    def __init__(self, jobs: int = 1, baseline_cache=None, result_cache=None, limits=None):
+        """
+		jobs is the number of solutions graded at once. Their code runs on the shared execution pool, which
+		should have at least as many workers.
+		baseline_cache is an optional cache.BaselineCache that run_baseline reuses measurements from.
+		result_cache is an optional cache.ResultCache of grades for solutions that have not changed.
+		limits overrides entries of the execution pool's limits (see execution.DEFAULT_LIMITS) for this grader.
+		"""
+        self.jobs = jobs
+        self.baseline_cache = baseline_cache
+        self.result_cache = result_cache
+        self.limits = limits or {}
+
     @classmethod
-    def resolve_graders(cls, grader_names: List[str]) -> List['Grader']:
+    def resolve_graders(cls, grader_names: List[str], **kwargs) -> List['Grader']:
         subclass_mapping = {subclass.identifier: subclass for subclass in cls.__subclasses__()}
         instances = []
         for grader_name in grader_names:
             subclass = subclass_mapping.get(grader_name, CorrectnessGrader)
-            instances.append(subclass())
+            instances.append(subclass(**kwargs))
         return instances
 
     @classmethod
     def run_function(cls, code: str, function_prototype: FunctionPrototype, test_case: TestCase, iterations=1,
-                     collect_cpu_time=False, collect_memory_usage=False) -> execution.FunctionExecutionResult:
+                     collect_cpu_time=False, collect_memory_usage=False,
+                     timing=None, limits=None,
+                     memory_backend=execution.DEFAULT_MEMORY_BACKEND) -> execution.FunctionExecutionResult:
         """
-		Runs generated Python code against a given test case.
+		Runs generated Python code against a given test case on a warm worker from the shared execution pool.
 		"""
         parameters = function_prototype.get_ordered_parameter_values(test_case)
-        return execution.execute_function(code, parameters, iterations, collect_cpu_time, collect_memory_usage)
-        pass
+        return execution.get_default_pool().execute_function(code, parameters, iterations, collect_cpu_time,
+                                                             collect_memory_usage, timing, limits, memory_backend)
+
+    @classmethod
+    def run_batch(cls, code: str, function_prototype: FunctionPrototype, test_cases: List[TestCase], iterations=1,
+                  collect_cpu_time=False, collect_memory_usage=False,
+                  timing=None, limits=None,
+                  memory_backend=execution.DEFAULT_MEMORY_BACKEND,
+                  stress=None, profile=False) -> List[execution.FunctionExecutionResult]:
+        """
+		Runs generated Python code against every test case, defining the code only once.
+		Returns one result per test case, in order.
+		"""
+        parameter_lists = [function_prototype.get_ordered_parameter_values(test_case) for test_case in test_cases]
+        return execution.get_default_pool().execute_batch(code, parameter_lists, iterations, collect_cpu_time,
+                                                          collect_memory_usage, timing, limits, memory_backend,
+                                                          stress, profile)
+
+    def execution_limits(self, problem: ProblemDefinition) -> dict:
+        """
+		The limits to run code for problem under: the grader's limits, overridden by the problem's
+		execution_limits field.
+		"""
+        return dict(self.limits, **problem.additional_fields.get('execution_limits', {}))
+
+    def effective_limits(self, problem: ProblemDefinition) -> dict:
+        """
+		All the limits code for problem runs under: the shared execution pool's, overridden by execution_limits.
+		"""
+        return dict(execution.get_default_pool().limits, **self.execution_limits(problem))
+
+    def run_baseline(self, problem: ProblemDefinition, test_cases: List[TestCase],
+                     **kwargs) -> List[execution.FunctionExecutionResult]:
+        """
+		Runs problem.optimal_solution against every test case like run_batch, under the problem's limits, reusing
+		the measurements stored in self.baseline_cache and storing the ones it had to take.
+		"""
+        limits = self.execution_limits(problem)
+        if self.baseline_cache is None:
+            return Grader.run_batch(problem.optimal_solution, problem.function_prototype, test_cases, limits=limits,
+                                    **kwargs)
+
+        keys = [self.baseline_cache.key(problem.optimal_solution, test_case, kwargs) for test_case in test_cases]
+        results = [self.baseline_cache.get(key) for key in keys]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            measured = Grader.run_batch(problem.optimal_solution, problem.function_prototype,
+                                        [test_cases[index] for index in missing], limits=limits, **kwargs)
+            for index, result in zip(missing, measured):
+                results[index] = result
+                if not result.error:
+                    self.baseline_cache.put(keys[index], result)
+        return results
 
     @classmethod
     def can_grade(cls, problems: List[ProblemDefinition]) -> bool:
@@ -51,12 +125,69 @@ class Grader(ABC):
                 return False
         return True
 
-    @abstractmethod
     def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
         """
 		Grades the provided solutions against the problem definitions.
+		Graders that implement grade_solution get this driver, which matches each solution to its problem,
+		warns about solutions that match no problem, grades up to self.jobs solutions at once and returns the
+		grades in their original order.
 		"""
-        pass
+        solutions_by_problem = {}
+        for solution in solutions:
+            solutions_by_problem.setdefault(solution.problem_identifier, []).append(solution)
+
+        pairs = []
+        for problem in problems:
+            pairs += [(problem, solution) for solution in solutions_by_problem.pop(problem.identifier, [])]
+
+        for problem_identifier, unmatched_solutions in solutions_by_problem.items():
+            for solution in unmatched_solutions:
+                print(f"Warning: no problem '{problem_identifier}' found for the solution from model "
+                      f"{solution.model_identifier} to prompt {solution.prompt_identifier}; it will not be graded.")
+
+        grades = self.map_jobs(lambda pair: self.grade_solution_cached(*pair), pairs)
+        return GradingOutput([grade for grade in grades if grade is not None], self.identifier)
+
+    def settings(self) -> dict:
+        """
+		Options of this grader that change the grades it gives, distinguishing them in the result cache.
+		"""
+        return {}
+
+    def result_cache_key(self, problem: ProblemDefinition, solution: LLMSolution) -> str:
+        return self.result_cache.key(self.identifier, self.version, problem, solution.solution_code, self.settings(),
+                                     self.effective_limits(problem))
+
+    def grade_solution_cached(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Returns the grade self.result_cache holds for the solution, grading and caching it if there is none.
+		"""
+        if self.result_cache is None:
+            return self.grade_solution(problem, solution)
+
+        key = self.result_cache_key(problem, solution)
+        grade = self.result_cache.get(key, solution)
+        if grade is None:
+            grade = self.grade_solution(problem, solution)
+            if grade is not None:
+                self.result_cache.put(key, grade)
+        return grade
+
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Grades a single solution against its problem definition.
+		Returns None if the solution could not be graded.
+		"""
+        raise NotImplementedError(f"{self.__class__.__name__} must implement grade or grade_solution")
+
+    def map_jobs(self, function, items: list) -> list:
+        """
+		Applies function to every item using up to self.jobs threads, returning the results in order.
+		"""
+        if self.jobs <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(function, items))
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}()"
@@ -68,87 +199,161 @@ class CorrectnessGrader(Grader):
     def identifier(self):
         return "correctness"
 
-    def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
-        solutionGrades = []
-        for problem in problems:
-            function_prototype = problem.function_prototype
-            for solution in solutions:
-                number_correct = 0
-                total_tests = 0
-                issues = []
-                if solution.problem_identifier == problem.identifier:
-                    print(f"Grading problem {problem.identifier}")
-                    for test_case in problem.correctness_test_suite:
-                        execution_results = Grader.run_function(solution.solution_code, function_prototype, test_case)
-                        expected_result = function_prototype.get_return_values(test_case)
-                        actual_result = execution_results.result
-
-                        total_tests += 1
-
-                        if execution_results.error:
-                            issues.append(
-                                f"Error encountered during execution for test case {test_case}: {execution_results.error}\n{execution_results.traceback}")
-                            print(issues[-1])
-                        elif expected_result == actual_result:
-                            number_correct += 1
-                        else:
-                            issues.append(
-                                f"Test failed:\n\t{test_case}\n\tFunction prototype: {function_prototype}\n\tExpected result: {expected_result} {type(expected_result)}\n\tActual result: {actual_result} {type(actual_result)}")
-                            print(issues[-1])
-
-                    score = 0
-                    if total_tests > 0:
-                        score = number_correct / total_tests
-                    grade = SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
-                                          score, None, issues)
-                    solutionGrades.append(grade)
-        return GradingOutput(solutionGrades, self.identifier)
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        function_prototype = problem.function_prototype
+        number_correct = 0
+        total_tests = 0
+        issues = []
+        print(f"Grading problem {problem.identifier}")
+        all_execution_results = Grader.run_batch(solution.solution_code, function_prototype,
+                                                 problem.correctness_test_suite,
+                                                 limits=self.execution_limits(problem))
+        for test_case, execution_results in zip(problem.correctness_test_suite, all_execution_results):
+            expected_result = function_prototype.get_return_values(test_case)
+            actual_result = execution_results.result
+
+            total_tests += 1
+
+            if execution_results.error:
+                issues.append(
+                    f"Error encountered during execution for test case {test_case}: {execution_results.error}\n{execution_results.traceback}")
+                print(issues[-1])
+            elif expected_result == actual_result:
+                number_correct += 1
+            else:
+                issues.append(
+                    f"Test failed:\n\t{test_case}\n\tFunction prototype: {function_prototype}\n\tExpected result: {expected_result} {type(expected_result)}\n\tActual result: {actual_result} {type(actual_result)}")
+                print(issues[-1])
+
+        score = 0
+        if total_tests > 0:
+            score = number_correct / total_tests
+        return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                             score, None, issues)
 
 
 class PerformanceGrader(Grader):
+    # Version 2 scores the test cases that the solution fails or times out on as 0 instead of leaving them out
+    version = 2
+
+    # Settings of the scaling mode, which times solutions on inputs made by the problem's input_generator at
+    # geometrically growing sizes: from start, growing by factor for up to steps sizes, stopping after the first
+    # size at which a call takes longer than max_call_time seconds. Complexities are fitted to the last
+    # fit_points sizes, and the fitted times compared at reference_size. timing is used for every size (see
+    # execution.DEFAULT_TIMING).
+    default_scaling = {
+        'start': 16,
+        'factor': 2,
+        'steps': 12,
+        'max_call_time': 0.1,
+        'fit_points': 4,
+        'reference_size': 2 ** 20,
+        'timing': {'repeat': 3, 'min_time': 0.02, 'max_time': 0.5}
+    }
+
+    # Overrides of default_scaling that turn the scaling mode on, or None to time the test suite
+    scaling = None
+
+    # Whether to profile the solution's timed calls with cProfile. The profile is saved next to the grade and its
+    # hot_function_count hottest functions are listed as issues
+    profile = False
+    hot_function_count = 5
+
+    # Exponents of n that fitted slopes are rounded to when estimating complexity
+    complexity_classes = {0: 'O(1)', 1: 'O(n)', 2: 'O(n^2)', 3: 'O(n^3)', 4: 'O(n^4)'}
+
     @classmethod
     @property
     def identifier(self):
         return "performance"
 
-    def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
-        solutionGrades = []
-        for problem in problems:
-            function_prototype = problem.function_prototype
-            for solution in solutions:
-                if solution.problem_identifier == problem.identifier:
-                    print(f"Grading problem {problem.identifier}")
-                    total_solution_time = 0
-                    total_optimal_time = 0
-                    issues = []
-                    for test_case in problem.correctness_test_suite:
-                        iterations = 1  # Starting with 1 iteration
-                        while True:  # Continue running until a break condition is met
-                            solution_results = Grader.run_function(solution.solution_code, function_prototype,
-                                                                   test_case, iterations=iterations,
-                                                                   collect_cpu_time=True)
-                            optimal_results = Grader.run_function(problem.optimal_solution, function_prototype,
-                                                                  test_case, iterations=iterations,
-                                                                  collect_cpu_time=True)
-
-                            if solution_results.cpu_time is None or optimal_results.cpu_time is None:
-                                break
-
-                            total_solution_time += solution_results.cpu_time
-                            total_optimal_time += optimal_results.cpu_time
-
-                            # Check if either total time exceeds 2 seconds
-                            if total_solution_time > 0.4 or total_optimal_time > 0.4:
-                                break
-                            else:
-                                iterations *= 10  # Increase iterations by 10 times
-
-                    if total_solution_time > 0:
-                        overall_grade = min(1, total_optimal_time / total_solution_time)
-                        grade = SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
-                                              overall_grade, None, issues)
-                        solutionGrades.append(grade)
-        return GradingOutput(solutionGrades, self.identifier)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.optimal_curves = {}
+        self.lock = threading.Lock()
+
+    def settings(self) -> dict:
+        settings = {}
+        if self.scaling is not None:
+            settings['scaling'] = self.scaling_settings()
+        if self.profile:
+            settings['profile'] = self.hot_function_count
+        return settings
+
+    def scaling_settings(self) -> dict:
+        return dict(self.default_scaling, **self.scaling)
+
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Times the solution and the optimal solution on every test case with the calibrated timing harness, and
+		scores the solution by the ratio of their summed median CPU times per call, scaled down by the share of
+		test cases the solution failed on, such as by timing out. Test cases the optimal solution fails on are
+		left out.
+		In scaling mode, problems with an input_generator are graded by grade_scaling instead.
+		"""
+        if self.scaling is not None:
+            if 'input_generator' in problem.additional_fields:
+                return self.grade_scaling(problem, solution)
+            print(f"Problem {problem.identifier} has no input_generator; timing its test suite instead")
+
+        function_prototype = problem.function_prototype
+        print(f"Grading problem {problem.identifier}")
+        test_suite = problem.correctness_test_suite
+        solution_results = Grader.run_batch(solution.solution_code, function_prototype, test_suite,
+                                            timing=execution.DEFAULT_TIMING, limits=self.execution_limits(problem),
+                                            profile=self.profile)
+        optimal_results = self.run_baseline(problem, test_suite, timing=execution.DEFAULT_TIMING)
+
+        total_solution_time = 0
+        total_optimal_time = 0
+        solution_spreads = []
+        optimal_spreads = []
+        issues = []
+        failed_cases = 0
+        for test_case, solution_result, optimal_result in zip(test_suite, solution_results, optimal_results):
+            if optimal_result.error:
+                issues.append(f"Error encountered while timing the optimal solution on test case {test_case}: "
+                              f"{optimal_result.error}")
+                continue
+            if solution_result.error:
+                issues.append(f"Error encountered while timing test case {test_case}: {solution_result.error}")
+                failed_cases += 1
+                continue
+
+            total_solution_time += solution_result.timing['cpu_time_median']
+            total_optimal_time += optimal_result.timing['cpu_time_median']
+            solution_spreads.append(solution_result.timing['cpu_time_stdev'] / max(solution_result.timing['cpu_time_median'], 1e-12))
+            optimal_spreads.append(optimal_result.timing['cpu_time_stdev'] / max(optimal_result.timing['cpu_time_median'], 1e-12))
+
+        timed_cases = len(solution_spreads)
+        if timed_cases + failed_cases == 0:
+            return None
+        overall_grade = 0
+        if timed_cases > 0:
+            overall_grade = (min(1, total_optimal_time / max(total_solution_time, 1e-12))
+                             * timed_cases / (timed_cases + failed_cases))
+        sub_criteria_scores = {
+            "solution_cpu_time": total_solution_time,
+            "optimal_cpu_time": total_optimal_time,
+            "solution_relative_spread": max(solution_spreads, default=0),
+            "optimal_relative_spread": max(optimal_spreads, default=0),
+            "failed_test_cases": failed_cases
+        }
+        return self.with_profile(SolutionGrade(problem.identifier, solution.prompt_identifier,
+                                               solution.model_identifier, overall_grade, sub_criteria_scores,
+                                               issues), solution_results)
+
+    def with_profile(self, grade: SolutionGrade, results: List[execution.FunctionExecutionResult]) -> SolutionGrade:
+        """
+		Attaches the merged profile of results to grade and lists its hottest functions as issues.
+		"""
+        profiles = [result.profile for result in results if result.profile]
+        if profiles:
+            grade.profile = execution.merge_profiles(profiles)
+            for function in execution.hot_functions(grade.profile, self.hot_function_count):
+                grade.issues.append(f"Hot function {function['function']}: {function['own_time']:.6f}s in its own "
+                                    f"code, {function['cumulative_time']:.6f}s cumulative, over {function['calls']} calls")
+        return grade
 
     def can_grade(cls, problems: List[ProblemDefinition]) -> bool:
         """
@@ -161,155 +366,523 @@ class PerformanceGrader(Grader):
                 return False
         return True
 
+    def measure_curve(self, code: str, problem: ProblemDefinition, generate,
+                      profile: bool = False) -> Tuple[List[Tuple[int, float]], List[execution.FunctionExecutionResult], List[str]]:
+        """
+		Times code on the inputs generate makes at each size of the scaling settings, until a call takes longer
+		than max_call_time or fails, or generate fails. The generated values are passed to code as they are.
+		Returns the (size, median CPU time per call) points, the execution results and any errors.
+		"""
+        settings = self.scaling_settings()
+        limits = self.execution_limits(problem)
+        points = []
+        results = []
+        for step in range(settings['steps']):
+            size = settings['start'] * settings['factor'] ** step
+            try:
+                parameters = problem.function_prototype.order_parameter_values(generate(size))
+            except Exception as e:
+                return points, results, [f"Error encountered while generating input size {size}: "
+                                         f"{type(e).__name__}: {e}"]
+            result = execution.get_default_pool().execute_batch(code, [parameters], timing=settings['timing'],
+                                                                limits=limits, profile=profile)[0]
+            results.append(result)
+            if result.error:
+                return points, results, [f"Error encountered while timing input size {size}: {result.error}"]
+            points.append((size, result.timing['cpu_time_median']))
+            if result.timing['cpu_time_median'] > settings['max_call_time']:
+                break
+        return points, results, []
+
+    def optimal_curve(self, problem: ProblemDefinition, generate) -> Tuple[List[Tuple[int, float]], List[str]]:
+        """
+		The scaling curve of problem.optimal_solution, measured once per optimal solution, input generator and
+		limits, since problems of different problem sets can share an identifier.
+		"""
+        key = cache.hash_text(json.dumps([problem.optimal_solution, problem.additional_fields['input_generator'],
+                                          self.effective_limits(problem)], sort_keys=True))
+        with self.lock:
+            if key in self.optimal_curves:
+                return self.optimal_curves[key]
+        points, _, issues = self.measure_curve(problem.optimal_solution, problem, generate)
+        curve = points, issues
+        with self.lock:
+            self.optimal_curves[key] = curve
+        return curve
+
+    def fit_curve(self, points: List[Tuple[int, float]]) -> Optional[Tuple[float, float]]:
+        """
+		Fits log(time) = slope * log(size) + intercept by least squares to the last fit_points points. Returns the
+		slope and intercept, or None with fewer than two points.
+		"""
+        points = [(math.log(size), math.log(max(cpu_time, 1e-12))) for size, cpu_time in points[-self.scaling_settings()['fit_points']:]]
+        if len(points) < 2:
+            return None
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / sum((x - mean_x) ** 2 for x, _ in points)
+        return slope, mean_y - slope * mean_x
+
+    def estimate_complexity(self, slope: float) -> str:
+        return self.complexity_classes[min(self.complexity_classes, key=lambda exponent: abs(exponent - slope))]
+
+    def grade_scaling(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Times the solution and the optimal solution on inputs of geometrically growing size made by the problem's
+		input_generator, and fits the slope of log time against log size to each. The score is the ratio of
+		their fitted times at reference_size, capped at 1, so that it reflects asymptotic behaviour rather than
+		constant factors on small inputs. Also reports the estimated complexities and the size at which the
+		fitted times cross, if it is below reference_size. A solution that fails, such as by timing out, before it
+		is measured at two sizes scores 0.
+		"""
+        print(f"Grading problem {problem.identifier} at growing input sizes")
+        try:
+            generate = execution.define_function(problem.additional_fields['input_generator'])
+        except Exception as e:
+            print(f"Could not define the input generator of problem {problem.identifier}: {e}")
+            return None
+        solution_points, solution_results, issues = self.measure_curve(solution.solution_code, problem, generate,
+                                                                       self.profile)
+        optimal_points, optimal_issues = self.optimal_curve(problem, generate)
+        issues += [f"Optimal solution: {issue}" for issue in optimal_issues]
+
+        solution_fit = self.fit_curve(solution_points)
+        optimal_fit = self.fit_curve(optimal_points)
+        if optimal_fit is not None and solution_fit is None and solution_results and solution_results[-1].error:
+            # The solution failed, such as by timing out, before it could be measured at two sizes
+            return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier, 0,
+                                 {'largest_size': solution_points[-1][0] if solution_points else None}, issues)
+        if solution_fit is None or optimal_fit is None:
+            for issue in issues:
+                print(issue)
+            return None
+
+        solution_slope, solution_intercept = solution_fit
+        optimal_slope, optimal_intercept = optimal_fit
+        reference_size = self.scaling_settings()['reference_size']
+        log_reference_size = math.log(reference_size)
+        solution_reference_time = math.exp(solution_slope * log_reference_size + solution_intercept)
+        optimal_reference_time = math.exp(optimal_slope * log_reference_size + optimal_intercept)
+        # Only crossovers between a size of 1 and reference_size are reported; fitted lines that are nearly
+        # parallel cross far outside of what was measured
+        crossover_size = None
+        if solution_slope != optimal_slope:
+            log_crossover_size = (optimal_intercept - solution_intercept) / (solution_slope - optimal_slope)
+            if 0 <= log_crossover_size <= log_reference_size:
+                crossover_size = round(math.exp(log_crossover_size))
+
+        overall_grade = min(1, optimal_reference_time / solution_reference_time)
+        sub_criteria_scores = {
+            'solution_slope': solution_slope,
+            'optimal_slope': optimal_slope,
+            'solution_complexity': self.estimate_complexity(solution_slope),
+            'optimal_complexity': self.estimate_complexity(optimal_slope),
+            'crossover_size': crossover_size,
+            'solution_reference_time': solution_reference_time,
+            'optimal_reference_time': optimal_reference_time,
+            'largest_size': solution_points[-1][0]
+        }
+        # Profile the largest input only, where the time goes asymptotically
+        return self.with_profile(SolutionGrade(problem.identifier, solution.prompt_identifier,
+                                               solution.model_identifier, overall_grade, sub_criteria_scores, issues),
+                                 solution_results[-1:])
+
 
 class MemoryGrader(Grader):
+    # Version 2 averages the per-case ratios of peak memory instead of comparing sums across cases
+    version = 2
+
+    # How peak memory is measured, one of execution.MEMORY_BACKENDS
+    memory_backend = execution.DEFAULT_MEMORY_BACKEND
+
     @classmethod
     @property
     def identifier(self):
         return "memory"
 
-    def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
-        solutionGrades = []
-        for problem in problems:
-            function_prototype = problem.function_prototype
-            for solution in solutions:
-                if solution.problem_identifier == problem.identifier:
-                    print(f"Grading problem {problem.identifier}")
-                    total_solution_peak_memory = 0
-                    total_optimal_peak_memory = 0
-                    issues = []
-                    for test_case in problem.correctness_test_suite:
-                        iterations = 10
-                        solution_results = Grader.run_function(solution.solution_code, function_prototype, test_case,
-                                                               iterations=iterations, collect_memory_usage=True)
-                        optimal_results = Grader.run_function(problem.optimal_solution, function_prototype, test_case,
-                                                              iterations=iterations, collect_memory_usage=True)
-                        if solution_results.peak_memory is None or optimal_results.peak_memory is None:
-                            continue
-
-                        total_solution_peak_memory += solution_results.peak_memory
-                        total_optimal_peak_memory += optimal_results.peak_memory
-
-                    if total_solution_peak_memory > 0:
-                        overall_grade = min(1, total_optimal_peak_memory / total_solution_peak_memory)
-
-                        grade = SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
-                                              overall_grade, None, issues)
-                        solutionGrades.append(grade)
-        return GradingOutput(solutionGrades, self.identifier)
+    def settings(self) -> dict:
+        return {'memory_backend': self.memory_backend}
+
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Measures the peak memory of the solution and the optimal solution on every test case with
+		self.memory_backend, and scores the solution by the average over the test cases of the ratio of their peaks.
+		"""
+        function_prototype = problem.function_prototype
+        print(f"Grading problem {problem.identifier}")
+        total_solution_peak_memory = 0
+        total_optimal_peak_memory = 0
+        ratios = []
+        issues = []
+        # The high-water mark of a process does not change with repeated calls, so only tracemalloc repeats them
+        iterations = 10 if self.memory_backend == 'tracemalloc' else 1
+        test_suite = problem.correctness_test_suite
+        all_solution_results = Grader.run_batch(solution.solution_code, function_prototype, test_suite,
+                                                iterations=iterations, collect_memory_usage=True,
+                                                limits=self.execution_limits(problem),
+                                                memory_backend=self.memory_backend)
+        all_optimal_results = self.run_baseline(problem, test_suite, iterations=iterations, collect_memory_usage=True,
+                                                memory_backend=self.memory_backend)
+        for test_case, solution_results, optimal_results in zip(test_suite, all_solution_results, all_optimal_results):
+            if solution_results.error:
+                issues.append(f"Error encountered during execution for test case {test_case}: {solution_results.error}")
+            if solution_results.peak_memory is None or optimal_results.peak_memory is None:
+                continue
+
+            total_solution_peak_memory += solution_results.peak_memory
+            total_optimal_peak_memory += optimal_results.peak_memory
+            # Cases where neither allocates anything measurable say nothing about the solution
+            if solution_results.peak_memory > 0:
+                ratios.append(min(1, optimal_results.peak_memory / solution_results.peak_memory))
+            elif optimal_results.peak_memory > 0:
+                ratios.append(1)
+
+        if ratios:
+            overall_grade = sum(ratios) / len(ratios)
+            sub_criteria_scores = {
+                'solution_peak_memory': total_solution_peak_memory,
+                'optimal_peak_memory': total_optimal_peak_memory,
+                'cases_measured': len(ratios),
+                'memory_backend': self.memory_backend
+            }
+
+            return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                                 overall_grade, sub_criteria_scores, issues)
+        return None
 
 
 class StaticCodeGrader(Grader):
+    # Version 2 lints the solution code itself, in process, instead of running pylint on the solution's str()
+    version = 2
+
+    # Score given to every solution when pylint is not installed
+    fallback_score = 0.3
+
     @classmethod
     @property
     def identifier(self):
         return "staticthread"
 
     def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
-        solutionGrades = []
-        for problem in problems:
-            function_prototype = problem.function_prototype
-            for solution in solutions:
-                if solution.problem_identifier == problem.identifier:
-                    issues = []
-                    print(f"Grading problem {problem.identifier}")
-                    pylint_output = subprocess.getoutput(f"pylint {solution}")
-                    score_pattern = re.compile(r"Your code has been rated at ([0-9.]+)")
-                    match = score_pattern.search(pylint_output)
-                    overall_grade = 0.3
-                    if match:
-                        score = float(match.group(1)) / 10.0
-                        overall_grade = score
-                    grade = SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
-                                          overall_grade, None, issues)
-                    solutionGrades.append(grade)
-        return GradingOutput(solutionGrades, self.identifier)
-
-    class ThreadGrader(Grader):
-        @classmethod
-        @property
-        def identifier(self):
-            return "dynamicthread"
-
-        def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
-            solutionGrades = []
-            for problem in problems:
-                function_prototype = problem.function_prototype
-                for solution in solutions:
-                    issues = []
-                    if solution.problem_identifier == problem.identifier:
-                        print(f"Grading problem {problem.identifier}")
-                        tsan_output = subprocess.getoutput(f"ThreadSanitizer {solution}")
-                        race_reports = []
-                        race_report_start = re.compile(r"WARNING: ThreadSanitizer: data race (.+)")
-                        in_race_report = False
-                        grade = 0.0
-                        for line in tsan_output.splitlines():
-                            if re.match(race_report_start, line):
-                                in_race_report = True
-                                race_report = line
-                            elif in_race_report:
-                                race_report += "\n" + line
-                                if line.strip() == "":
-                                    race_reports.append(race_report)
-                                    in_race_report = False
-                        if not race_reports:
-                            overall_grade = 10.0
-
-                        # 根据竞争数量和严重性进行评分
-                        num_races = len(race_reports)
-                        severity_scores = {"WARNING: ThreadSanitizer: data race (": 3, "Race detected:": 2}
-                        total_score = 0
-
-                        for report in race_reports:
-                            for severity, score in severity_scores.items():
-                                if severity in report:
-                                    total_score += score
-                                    overall_grade = total_score
-                        grade = SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
-                                              overall_grade, None, issues)
-                        solutionGrades.append(grade)
-            return GradingOutput(solutionGrades, self.identifier)
+        # Lint the solutions that have no cached grade in one pylint run up front; grade_solution then reads the
+        # results from the memo
+        if lint.USE_PYLINT:
+            problems_by_identifier = {problem.identifier: problem for problem in problems}
+            codes = [solution.solution_code for solution in solutions
+                     if solution.problem_identifier in problems_by_identifier and (
+                         self.result_cache is None or not self.result_cache.contains(
+                             self.result_cache_key(problems_by_identifier[solution.problem_identifier], solution)))]
+            if codes:
+                lint.lint_batch(codes, self.jobs)
+        return super().grade(problems, solutions)
+
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Scores the solution by its pylint score, out of 1, and lists every message pylint reported as an issue.
+		"""
+        print(f"Grading problem {problem.identifier}")
+        if not lint.USE_PYLINT:
+            return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                                 self.fallback_score, None, ["pylint is not installed, so the code was not analyzed."])
+
+        result = lint.lint(solution.solution_code)
+        issues = [f"Line {message['line']}, column {message['column']}: {message['message-id']} "
+                  f"({message['symbol']}) {message['message']}" for message in result['messages']]
+        message_counts = {}
+        for message in result['messages']:
+            message_counts[message['type']] = message_counts.get(message['type'], 0) + 1
+        return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                             result['score'] / 10, message_counts, issues)
+
+
+def speedup(throughputs: Dict[str, float]) -> Optional[float]:
+    """
+	The throughput with the most threads relative to the throughput with the fewest, from a stress run.
+	"""
+    if len(throughputs) < 2:
+        return None
+    return throughputs[max(throughputs, key=int)] / throughputs[min(throughputs, key=int)]
 
 
-class HalsteadGrader(Grader):
+class ThreadGrader(Grader):
+    # Version 2 stress-runs the solution across threads instead of running an external race detector on it
+    version = 2
+
+    # Settings of the stress runs (see execution.DEFAULT_STRESS), and the number of worker processes that
+    # stress-run each test case at once
+    stress = execution.DEFAULT_STRESS
+    processes = 2
+
+    # Time limit, in seconds, of a whole stress run, used unless the grader or the problem sets a timeout
+    stress_timeout = 30
+
+    # Share of the score given to throughput scaling; the rest goes to rounds that did not diverge
+    scaling_weight = 0.2
+
     @classmethod
     @property
     def identifier(self):
-        return "halstead"
+        return "dynamicthread"
 
-    def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
+    def settings(self) -> dict:
+        return {'stress': self.stress, 'processes': self.processes}
 
-        def halstead_difficulty(code):
-            operators = {'+', '-', '*', '/', '%', '//', '**', '<<', '>>', '&', '|', '^', '~', '<', '>', '<=', '>=',
-                         '==', '!=',
-                         'and', 'or', 'not', 'is', 'in', '+=', '-=', '*=', '/=', '%=', '&=', '|=', '^=', '<<=', '>>=',
-                         '//=', '**=',
-                         '(', ')', '[', ']', '{', '}', '@', ',', ':', '.', '=', '->', '-=', '*=', '/=', '%=', '&=',
-                         '|=', '^=', '<<=', '>>=', '//=', '**=', ';'}
+    def execution_limits(self, problem: ProblemDefinition) -> dict:
+        return dict({'timeout': self.stress_timeout}, **super().execution_limits(problem))
 
-            words = code.replace('\n', ' ').replace('\t', ' ').split(' ')
-            operands = [word for word in words if not any(op in word for op in operators) and word]
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Stress-runs the solution on every test case in self.processes fresh worker processes at once, on a pool
+		of that many workers of its own (see execution.stress_function). A deadlock, or a stress run that times
+		out, scores 0. Otherwise the score combines the share of rounds in which every call agreed with the
+		single-threaded result, and the throughput with the most threads relative to the throughput with one,
+		capped at 1.
+		Problems without test cases are stress-run once without arguments.
+		"""
+        print(f"Grading problem {problem.identifier}")
+        test_suite = problem.correctness_test_suite or [TestCase({})]
+        parameter_lists = [problem.function_prototype.get_ordered_parameter_values(test_case)
+                           for test_case in problem.correctness_test_suite] or [[]]
+        # The shared pool runs as many jobs at once as --jobs allows, so the processes get a pool of their own
+        pool = execution.WorkerPool(size=self.processes, limits=self.effective_limits(problem))
+        try:
+            with ThreadPoolExecutor(max_workers=self.processes) as executor:
+                runs = list(executor.map(lambda _: pool.execute_batch(solution.solution_code, parameter_lists,
+                                                                      stress=self.stress),
+                                         range(self.processes)))
+        finally:
+            pool.shutdown()
+
+        rounds = 0
+        diverged_rounds = 0
+        deadlocks = 0
+        scalings = []
+        throughputs = {}
+        issues = []
+        for results in runs:
+            for test_case, execution_result in zip(test_suite, results):
+                stress = execution_result.stress
+                if execution_result.limit_exceeded == 'timeout':
+                    # A run that never finishes, such as one stuck on its first call, is treated as a deadlock
+                    deadlocks += 1
+                    issues.append(f"Timed out while stress-running test case {test_case}: {execution_result.error}")
+                    continue
+                if execution_result.error or stress is None:
+                    issues.append(f"Error encountered during stress run for test case {test_case}: "
+                                  f"{execution_result.error}")
+                    continue
+
+                rounds += stress['rounds']
+                diverged_rounds += stress['diverged_rounds']
+                if stress['deadlocked']:
+                    deadlocks += 1
+                    issues.append(f"Deadlocked while stress-running test case {test_case}")
+                if stress['diverged_rounds']:
+                    issues.append(f"Results diverged in {stress['diverged_rounds']} of {stress['rounds']} rounds for "
+                                  f"test case {test_case}, e.g. {stress['divergent_results']}")
+                if not stress['deterministic']:
+                    issues.append(f"Results differ between single-threaded calls for test case {test_case}; only "
+                                  f"exceptions were counted as divergence")
+                for thread_count, throughput in stress['throughput'].items():
+                    throughputs.setdefault(thread_count, []).append(throughput)
+                if speedup(stress['throughput']) is not None:
+                    scalings.append(speedup(stress['throughput']))
+
+        if rounds == 0 and deadlocks == 0:
+            for issue in issues:
+                print(issue)
+            return None
+
+        race_frequency = diverged_rounds / rounds if rounds > 0 else 0
+        scaling = sum(scalings) / len(scalings) if scalings else 1
+        overall_grade = 0
+        if deadlocks == 0:
+            overall_grade = min(1, max(0, (1 - self.scaling_weight) * (1 - race_frequency)
+                                          + self.scaling_weight * min(1, scaling)))
+        sub_criteria_scores = {
+            'race_frequency': race_frequency,
+            'rounds': rounds,
+            'diverged_rounds': diverged_rounds,
+            'deadlocks': deadlocks,
+            'scaling': scaling,
+            'processes': self.processes
+        }
+        for thread_count, values in sorted(throughputs.items(), key=lambda item: int(item[0])):
+            sub_criteria_scores[f'throughput_{thread_count}_threads'] = sum(values) / len(values)
+        return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                             overall_grade, sub_criteria_scores, issues)
+
+
+class ScalabilityGrader(Grader):
+    # Thread and worker process counts that throughput is measured at, along with the machine's CPU count
+    concurrency = [1, 2, 4]
+
+    # Lists and strings among the test case inputs are repeated this many times, so that each call does enough
+    # work to be timed
+    input_scale = 10
+
+    # Settings of the thread runs (see execution.DEFAULT_STRESS) and of the timed runs in each worker process
+    # (see execution.DEFAULT_TIMING)
+    stress = {'round_time': 0.05, 'max_calls': 1000, 'rounds': 0}
+    timing = {'repeat': 3, 'min_time': 0.05, 'max_time': 1}
 
-            # operator_count = sum(code.count(op) for op in operators)
-            operand_count = len(operands)
+    @classmethod
+    @property
+    def identifier(self):
+        return "scalability"
 
-            unique_operators = len(set(op for op in code.split() if op in operators))
-            unique_operands = len(set(operands))
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.optimal_thread_speedups = {}
+        self.lock = threading.Lock()
 
-            difficulty = (unique_operators / 2) * (operand_count / unique_operands)
+    def settings(self) -> dict:
+        return {'concurrency': self.concurrency_levels(), 'input_scale': self.input_scale}
 
-            return difficulty
+    def concurrency_levels(self) -> List[int]:
+        return sorted(set(self.concurrency + [os.cpu_count() or 1]))
 
-        solutionGrades = []
-        for problem in problems:
-            for solution in solutions:
-                if solution.problem_identifier == problem.identifier:
-                    # calculate halstead for solution.solution_code
-                    score = halstead_difficulty(solution.solution_code)
+    def scaled_parameter_lists(self, problem: ProblemDefinition) -> List[list]:
+        """
+		The ordered parameters of every test case, with lists and strings repeated self.input_scale times.
+		Problems without test cases are called without arguments.
+		"""
+        if not problem.correctness_test_suite:
+            return [[]]
+        return [[value * self.input_scale if isinstance(value, (list, str)) else value
+                 for value in problem.function_prototype.get_ordered_parameter_values(test_case)]
+                for test_case in problem.correctness_test_suite]
+
+    def thread_throughputs(self, code: str, problem: ProblemDefinition) -> List[execution.FunctionExecutionResult]:
+        """
+		Measures the calls per second of code on every test case with every number of threads calling it at once
+		in one worker process.
+		"""
+        stress = dict(self.stress, threads=self.concurrency_levels())
+        return execution.get_default_pool().execute_batch(code, self.scaled_parameter_lists(problem),
+                                                          limits=self.execution_limits(problem), stress=stress)
+
+    def process_throughputs(self, code: str, problem: ProblemDefinition) -> List[Dict[int, float]]:
+        """
+		Measures the calls per second of code on every test case with every number of worker processes timing it
+		at once, on a pool of that many workers of its own. Returns, per test case, the throughput by process
+		count, leaving out counts at which any worker failed.
+		"""
+        parameter_lists = self.scaled_parameter_lists(problem)
+        limits = self.effective_limits(problem)
+        throughputs = [{} for _ in parameter_lists]
+        for process_count in self.concurrency_levels():
+            pool = execution.WorkerPool(size=process_count, limits=limits)
+            try:
+                with ThreadPoolExecutor(max_workers=process_count) as executor:
+                    runs = list(executor.map(lambda _: pool.execute_batch(code, parameter_lists, timing=self.timing),
+                                             range(process_count)))
+            finally:
+                pool.shutdown()
+            for index in range(len(parameter_lists)):
+                results = [results[index] for results in runs]
+                if all(not result.error and result.timing for result in results):
+                    throughputs[index][process_count] = sum(1 / max(result.timing['wall_time_median'], 1e-12)
+                                                            for result in results)
+        return throughputs
+
+    def optimal_thread_speedup(self, problem: ProblemDefinition) -> Optional[float]:
+        """
+		The speedup of problem.optimal_solution from one thread to the most, measured once per optimal solution,
+		scaled inputs and limits, since problems of different problem sets can share an identifier.
+		"""
+        key = cache.hash_text(json.dumps([problem.optimal_solution, self.scaled_parameter_lists(problem),
+                                          self.effective_limits(problem)], sort_keys=True, default=repr))
+        with self.lock:
+            if key in self.optimal_thread_speedups:
+                return self.optimal_thread_speedups[key]
+        speedups = [speedup(result.stress['throughput'])
+                    for result in self.thread_throughputs(problem.optimal_solution, problem)
+                    if not result.error and result.stress and not result.stress['deadlocked']]
+        speedups = [value for value in speedups if value is not None]
+        optimal_speedup = sum(speedups) / len(speedups) if speedups else None
+        with self.lock:
+            self.optimal_thread_speedups[key] = optimal_speedup
+        return optimal_speedup
+
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        """
+		Measures the throughput of the solution on scaled-up inputs with 1, 2, 4 and as many threads as the
+		machine has CPUs calling it at once, and with as many worker processes running it at once, and records
+		the throughput, speedup and parallel efficiency at every count.
+		The score is the speedup with the most threads relative to that of the optimal solution, capped at 1.
+		Problems without an optimal solution are compared with the speedup of the solution's own worker
+		processes instead, which is what the machine allows.
+		"""
+        print(f"Grading problem {problem.identifier}")
+        issues = []
+        thread_curves = []
+        test_suite = problem.correctness_test_suite or [TestCase({})]
+        for test_case, result in zip(test_suite, self.thread_throughputs(solution.solution_code, problem)):
+            if result.error or not result.stress or result.stress['deadlocked']:
+                issues.append(f"Error encountered while measuring thread throughput for test case {test_case}: "
+                              f"{result.error or 'deadlocked'}")
+                continue
+            thread_curves.append({int(count): throughput for count, throughput in result.stress['throughput'].items()})
+        process_curves = [curve for curve in self.process_throughputs(solution.solution_code, problem) if curve]
+        if not thread_curves:
+            for issue in issues:
+                print(issue)
+            return None
+
+        sub_criteria_scores = {}
+        for kind, curves in (('thread', thread_curves), ('process', process_curves)):
+            for count in self.concurrency_levels():
+                values = [curve[count] for curve in curves if count in curve and 1 in curve]
+                if not values:
+                    continue
+                speedups = [curve[count] / curve[1] for curve in curves if count in curve and 1 in curve]
+                sub_criteria_scores[f'{kind}_throughput_{count}'] = sum(values) / len(values)
+                sub_criteria_scores[f'{kind}_speedup_{count}'] = sum(speedups) / len(speedups)
+                sub_criteria_scores[f'{kind}_efficiency_{count}'] = sub_criteria_scores[f'{kind}_speedup_{count}'] / count
+
+        most = self.concurrency_levels()[-1]
+        thread_speedup = sub_criteria_scores.get(f'thread_speedup_{most}')
+        reference_speedup = None
+        if problem.optimal_solution:
+            reference_speedup = self.optimal_thread_speedup(problem)
+            sub_criteria_scores['optimal_thread_speedup'] = reference_speedup
+            sub_criteria_scores['scaling_reference'] = 'optimal_solution'
+        if reference_speedup is None:
+            reference_speedup = sub_criteria_scores.get(f'process_speedup_{most}')
+            sub_criteria_scores['scaling_reference'] = 'processes'
+        if thread_speedup is None or not reference_speedup:
+            for issue in issues:
+                print(issue)
+            return None
+
+        overall_grade = min(1, thread_speedup / reference_speedup)
+        return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                             overall_grade, sub_criteria_scores, issues)
+
+
+class HalsteadGrader(Grader):
+    @classmethod
+    @property
+    def identifier(self):
+        return "halstead"
+
+    # Version 2 replaced the whitespace-splitting estimate with metrics computed from Python tokens
+    version = 2
+
+    @staticmethod
+    def halstead_difficulty(code):
+        return halstead.halstead_metrics(code)['difficulty']
+
+    def grade(self, problems: List[ProblemDefinition], solutions: List[LLMSolution]) -> GradingOutput:
+        # Compute the metrics of the whole batch up front; grade_solution then reads them from the memo
+        halstead.halstead_metrics_batch([solution.solution_code for solution in solutions])
+        return super().grade(problems, solutions)
 
-                    grade = SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
-                                          score, None, [])
-                    solutionGrades.append(grade)
+    def grade_solution(self, problem: ProblemDefinition, solution: LLMSolution) -> Optional[SolutionGrade]:
+        # calculate halstead for solution.solution_code
+        metrics = halstead.halstead_metrics(solution.solution_code)
+        score = metrics['difficulty']
 
-        return GradingOutput(solutionGrades, self.identifier)
\ No newline at end of file
+        return SolutionGrade(problem.identifier, solution.prompt_identifier, solution.model_identifier,
+                             score, metrics, [])
@@ -0,0 +1,91 @@
+from base_types import *
+from typing import Tuple
+from cache import hash_text
+import io
+import keyword
+import math
+import threading
+import tokenize
+
+# Keywords that name values rather than operations, and so count as operands
+OPERAND_KEYWORDS = {'True', 'False', 'None'}
+
+# Closing brackets are counted with their opening bracket, as a single operator
+CLOSING_BRACKETS = {')', ']', '}'}
+
+# Tokens that are layout rather than code
+IGNORED_TOKEN_TYPES = {tokenize.ENCODING, tokenize.ENDMARKER, tokenize.NEWLINE, tokenize.NL, tokenize.INDENT,
+					   tokenize.DEDENT, tokenize.COMMENT}
+
+_metrics_cache = {}
+_metrics_cache_lock = threading.Lock()
+
+def tokens(code: str) -> List[tokenize.TokenInfo]:
+	"""
+	Returns the tokens of code, stopping at the first tokenization error for code that does not parse.
+	"""
+	result = []
+	try:
+		for token in tokenize.generate_tokens(io.StringIO(code).readline):
+			result.append(token)
+	except (tokenize.TokenError, IndentationError, SyntaxError):
+		pass
+	return result
+
+def operators_and_operands(code: str) -> Tuple[List[str], List[str]]:
+	operators, operands = [], []
+	for token in tokens(code):
+		if token.type in IGNORED_TOKEN_TYPES:
+			continue
+		if token.type == tokenize.OP:
+			if token.string not in CLOSING_BRACKETS:
+				operators.append(token.string)
+		elif token.type == tokenize.NAME and keyword.iskeyword(token.string) and token.string not in OPERAND_KEYWORDS:
+			operators.append(token.string)
+		elif token.type in (tokenize.NAME, tokenize.NUMBER, tokenize.STRING):
+			operands.append(token.string)
+	return operators, operands
+
+def compute_metrics(code: str) -> Dict[str, float]:
+	operators, operands = operators_and_operands(code)
+	
+	n1, n2 = len(set(operators)), len(set(operands))
+	N1, N2 = len(operators), len(operands)
+	vocabulary = n1 + n2
+	length = N1 + N2
+	volume = length * math.log2(vocabulary) if vocabulary > 0 else 0
+	difficulty = (n1 / 2) * (N2 / n2) if n2 > 0 else 0
+	
+	return {
+		'n1': n1,
+		'n2': n2,
+		'N1': N1,
+		'N2': N2,
+		'vocabulary': vocabulary,
+		'length': length,
+		'volume': volume,
+		'difficulty': difficulty,
+		'effort': difficulty * volume
+	}
+
+def halstead_metrics(code: str) -> Dict[str, float]:
+	"""
+	Computes the Halstead metrics of code: the numbers of distinct (n1) and total (N1) operators, the numbers of
+	distinct (n2) and total (N2) operands, and the vocabulary, length, volume, difficulty and effort derived from
+	them. Results are memoized by the hash of the code.
+	"""
+	key = hash_text(code)
+	with _metrics_cache_lock:
+		metrics = _metrics_cache.get(key)
+	if metrics is None:
+		metrics = compute_metrics(code)
+		with _metrics_cache_lock:
+			_metrics_cache[key] = metrics
+	return dict(metrics)
+
+def halstead_metrics_batch(codes: List[str]) -> List[Dict[str, float]]:
+	"""
+	Computes the Halstead metrics of each of codes, tokenizing each distinct piece of code once.
+	"""
+	metrics_by_code = {code: halstead_metrics(code) for code in set(codes)}
+	return [dict(metrics_by_code[code]) for code in codes]
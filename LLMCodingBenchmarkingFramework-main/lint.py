@@ -0,0 +1,88 @@
+from base_types import *
+from cache import hash_text
+import io
+import os
+import tempfile
+import threading
+
+# pylint is optional; without it, StaticCodeGrader gives every solution a fixed score
+try:
+	from pylint.lint import Run
+	from pylint.reporters.json_reporter import JSONReporter
+	USE_PYLINT = True
+except ImportError:
+	USE_PYLINT = False
+
+# Names of the modules solutions are written to, followed by the start of the hash of their code
+MODULE_PREFIX = "solution_"
+
+_lint_cache = {}
+_lint_cache_lock = threading.Lock()
+# pylint keeps global state while it runs, so only one run happens at a time
+_pylint_lock = threading.Lock()
+
+def module_name(key: str) -> str:
+	return MODULE_PREFIX + key[:32]
+
+def module_score(statistics: Dict[str, int]) -> float:
+	"""
+	Scores a module out of 10 with pylint's default evaluation, from the counts of its messages by category and
+	of its statements.
+	"""
+	statements = statistics.get('statement', 0)
+	if statistics.get('fatal', 0) or statements == 0:
+		return 0.0
+	penalty = 5 * statistics.get('error', 0) + statistics.get('warning', 0) + statistics.get('refactor', 0) + statistics.get('convention', 0)
+	return max(0.0, 10.0 - penalty / statements * 10)
+
+def run_pylint(codes_by_key: Dict[str, str], jobs: int = 1) -> Dict[str, Dict[str, Any]]:
+	"""
+	Writes each piece of code to a module of its own in a temporary directory and lints all of them in a single
+	in-process pylint run, using up to jobs processes. Returns the score and messages of each code, by key.
+	"""
+	with tempfile.TemporaryDirectory() as directory:
+		keys_by_module = {}
+		paths = []
+		for key, code in codes_by_key.items():
+			name = module_name(key)
+			keys_by_module[name] = key
+			path = os.path.join(directory, name + ".py")
+			with open(path, 'w') as f:
+				f.write(code)
+			paths.append(path)
+
+		output = io.StringIO()
+		with _pylint_lock:
+			# Checks across modules are disabled, so that each code gets the messages it would get if linted alone
+			run = Run(paths + [f"--jobs={max(1, jobs)}", "--persistent=n", "--score=n", "--disable=duplicate-code"],
+				reporter=JSONReporter(output), exit=False)
+		by_module = run.linter.stats.by_module
+
+	results = {key: {'score': module_score(by_module.get(name, {})), 'messages': []} for name, key in keys_by_module.items()}
+	for message in json.loads(output.getvalue() or "[]"):
+		key = keys_by_module.get(message['module'])
+		if key is not None:
+			results[key]['messages'].append(message)
+	return results
+
+def lint_batch(codes: List[str], jobs: int = 1) -> List[Dict[str, Any]]:
+	"""
+	Lints each of codes with pylint, returning for each its score out of 10 and the messages pylint reported, as
+	dictionaries with the keys of pylint's JSON output. Each distinct piece of code is linted once, and results
+	are memoized by the hash of the code, so only code not seen before is linted, all in one pylint run.
+	"""
+	keys = [hash_text(code) for code in codes]
+	with _lint_cache_lock:
+		missing = {key: code for key, code in zip(keys, codes) if key not in _lint_cache}
+	if missing:
+		results = run_pylint(missing, jobs)
+		with _lint_cache_lock:
+			_lint_cache.update(results)
+	with _lint_cache_lock:
+		return [_lint_cache[key] for key in keys]
+
+def lint(code: str) -> Dict[str, Any]:
+	"""
+	Lints a single piece of code, see lint_batch.
+	"""
+	return lint_batch([code])[0]
@@ -1,19 +1,71 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List, Union, Optional, Any
 from base_types import *
+import cache
 import openai
+import asyncio
 import os
+import random
 import sys
 import subprocess
 import re
+import time
+
+# Largest completion requested from the OpenAI API
+MAX_COMPLETION_TOKENS = 1000
+
+# Retries of a rate-limited or failed OpenAI request before giving up, and the first backoff delay in seconds
+MAX_RETRIES = 6
+INITIAL_BACKOFF = 1
+
+class TokenBucket:
+	"""
+	Asynchronous token bucket that refills continuously at rate_per_minute, up to one minute's worth of tokens.
+	"""
+	def __init__(self, rate_per_minute: float):
+		self.rate = rate_per_minute / 60
+		self.capacity = rate_per_minute
+		self.tokens = rate_per_minute
+		self.updated = time.monotonic()
+		self.lock = asyncio.Lock()
+	
+	async def acquire(self, amount: float = 1):
+		"""
+		Waits until amount tokens are available and takes them. Requests larger than the bucket wait for a full bucket.
+		"""
+		amount = min(amount, self.capacity)
+		async with self.lock:
+			while True:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if self.tokens >= amount:
+					self.tokens -= amount
+					return
+				await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class RateLimits:
+	"""
+	Request and token budgets shared by concurrent queries. A limit of None is not enforced.
+	"""
+	def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+		self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+		self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+	
+	async def acquire(self, tokens: int):
+		if self.requests is not None:
+			await self.requests.acquire()
+		if self.tokens is not None:
+			await self.tokens.acquire(tokens)
 
 class AIModelQuerier(ABC):
 	"""
 	Abstract base class for AI models.
 	"""
 	
-	def __init__(self, model_identifier: str):
+	def __init__(self, model_identifier: str, response_cache: Optional[cache.ResponseCache] = None):
 		self._model_identifier = model_identifier
+		self.response_cache = response_cache
 	
 	@property
 	def model_identifier(self) -> str:
@@ -39,8 +91,16 @@ class AIModelQuerier(ABC):
 		"""
 		pass
 	
+	async def generate_solution_async(self, problem_input: LLMProblemInput, rate_limits: Optional['RateLimits'] = None) -> 'LLMSolution':
+		"""
+		Asynchronous version of generate_solution used by concurrent generation.
+		Queriers that cannot run concurrently keep this default, which blocks the event loop, so their prompts
+		are still answered one at a time.
+		"""
+		return self.generate_solution(problem_input)
+	
 	@classmethod
-	def resolve_queriers(cls, model_names: List[str], force_human: bool = False) -> List['AIModelQuerier']:
+	def resolve_queriers(cls, model_names: List[str], force_human: bool = False, response_cache: Optional[cache.ResponseCache] = None) -> List['AIModelQuerier']:
 		subclass_mapping = {model_name: subclass for subclass in cls.__subclasses__() 
 							for model_name in subclass.supported_model_names()}	
 		if force_human:
@@ -48,7 +108,7 @@ class AIModelQuerier(ABC):
 		instances = []
 		for model_name in model_names:
 			subclass = subclass_mapping.get(model_name, HumanAIModelQuerier)
-			instances.append(subclass(model_name))
+			instances.append(subclass(model_name, response_cache))
 		return instances
 	
 	@classmethod
@@ -135,20 +195,56 @@ class OpenAIModelQuerier(AIModelQuerier):
 		
 		return response
 
-	def generate_solution(self, problem_input: LLMProblemInput) -> 'LLMSolution':
+	def sampling_parameters(self) -> dict:
+		"""
+		The request parameters, other than the model and prompt, that the response depends on.
+		"""
+		return {
+			'endpoint': 'chat' if self.is_chat_based_model() else 'completion',
+			'max_tokens': MAX_COMPLETION_TOKENS
+		}
+	
+	def cached_response(self, prompt: str) -> Optional[str]:
+		if self.response_cache is None:
+			return None
+		response = self.response_cache.get(self.model_identifier, self.sampling_parameters(), prompt)
+		if response is not None:
+			print("***Using cached response")
+		return response
+	
+	def cache_response(self, prompt: str, response: str):
+		if self.response_cache is not None:
+			self.response_cache.put(self.model_identifier, self.sampling_parameters(), prompt, response)
+	
+	def construct_automated_prompt(self, problem_input: LLMProblemInput) -> str:
 		prompt = AIModelQuerier.construct_textual_prompt(problem_input)
 		
 		# Add additional instructions for automated prompting
 		prompt += "\n\nAfter analyzing the problem, provide your solution in a Markdown code block. Do not include tests in the Markdown code block. The last Markdown code block in your response will be directly executed for testing."
+		return prompt
+	
+	def solution_from_response(self, problem_input: LLMProblemInput, response: str) -> 'LLMSolution':
+		print(f"***Response:\n{response}")
+		solution = self.extract_code(response)
+		
+		print(f"***Extracted solution:\n{solution}")
+		return LLMSolution(problem_input.problem_id, self.model_identifier, problem_input.prompt_id, solution)
+
+	def generate_solution(self, problem_input: LLMProblemInput) -> 'LLMSolution':
+		prompt = self.construct_automated_prompt(problem_input)
 		
 		print(f"***Prompt:\n{prompt}")
+		
+		response = self.cached_response(prompt)
+		if response is not None:
+			return self.solution_from_response(problem_input, response)
 
 		# Send the prompt to the OpenAI API
 		if self.is_chat_based_model():
 			messages = [{"role": "user", "content": prompt}]
 			response = openai.ChatCompletion.create(
 				model=self.model_identifier,
-				max_tokens=1000,
+				max_tokens=MAX_COMPLETION_TOKENS,
 				messages = messages)
 			
 			# Extract the generated code
@@ -158,14 +254,60 @@ class OpenAIModelQuerier(AIModelQuerier):
 			response = openai.Completion.create(
 				engine=self.model_identifier,
 				prompt=prompt,
-				max_tokens=1000
+				max_tokens=MAX_COMPLETION_TOKENS
 			)
 			
 			# Extract the generated code
 			response = response.choices[0].text
-
-		print(f"***Response:\n{response}")
-		solution = self.extract_code(response)
 		
-		print(f"***Extracted solution:\n{solution}")
-		return LLMSolution(problem_input.problem_id, self.model_identifier, problem_input.prompt_id, solution)
+		self.cache_response(prompt, response)
+		return self.solution_from_response(problem_input, response)
+	
+	@staticmethod
+	def is_retryable(error: Exception) -> bool:
+		"""
+		Whether an OpenAI API error is a rate limit (HTTP 429), a server error (HTTP 5xx) or a transient network failure.
+		"""
+		if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout, openai.error.APIConnectionError)):
+			return True
+		http_status = getattr(error, 'http_status', None)
+		return isinstance(error, openai.error.OpenAIError) and (http_status == 429 or (http_status or 0) >= 500)
+	
+	async def generate_solution_async(self, problem_input: LLMProblemInput, rate_limits: Optional[RateLimits] = None) -> 'LLMSolution':
+		prompt = self.construct_automated_prompt(problem_input)
+		
+		print(f"***Prompt ({problem_input.problem_id}, {problem_input.prompt_id}):\n{prompt}")
+		
+		response = self.cached_response(prompt)
+		if response is not None:
+			return self.solution_from_response(problem_input, response)
+		
+		# Rough token estimate: about four characters per prompt token, plus the largest possible completion
+		estimated_tokens = len(prompt) // 4 + MAX_COMPLETION_TOKENS
+		
+		for attempt in range(MAX_RETRIES + 1):
+			if rate_limits is not None:
+				await rate_limits.acquire(estimated_tokens)
+			try:
+				if self.is_chat_based_model():
+					response = await openai.ChatCompletion.acreate(
+						model=self.model_identifier,
+						max_tokens=MAX_COMPLETION_TOKENS,
+						messages=[{"role": "user", "content": prompt}])
+					response = response.choices[0].message.content
+				else:
+					response = await openai.Completion.acreate(
+						engine=self.model_identifier,
+						prompt=prompt,
+						max_tokens=MAX_COMPLETION_TOKENS)
+					response = response.choices[0].text
+				break
+			except Exception as e:
+				if attempt == MAX_RETRIES or not OpenAIModelQuerier.is_retryable(e):
+					raise
+				delay = INITIAL_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+				print(f"OpenAI request for {problem_input.problem_id} ({problem_input.prompt_id}) failed with {e.__class__.__name__}: {e}. Retrying in {delay:.1f} seconds…")
+				await asyncio.sleep(delay)
+		
+		self.cache_response(prompt, response)
+		return self.solution_from_response(problem_input, response)
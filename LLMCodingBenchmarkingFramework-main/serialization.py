@@ -1,8 +1,111 @@
 from base_types import *
+from typing import Tuple
+import base64
 import os
 import pathlib
+import sqlite3
+import threading
+
+# Name of the single-file packed form of a problem set, kept at the root of the problem set
+PACKED_FILE_NAME = "packed.sqlite3"
+
+class PackedProblemSet:
+	"""
+	A problem set's problems, solutions and grades stored in a single SQLite file instead of one JSON file each.
+	When a problem set contains a packed file, the functions of this module read and write it in place of the
+	problems/, solutions/ and grades/ directories. Each problem's correctness_test_suite is stored in its own
+	column so that it can be loaded lazily without parsing the rest of the problem.
+	"""
+	def __init__(self, path: str):
+		self.path = path
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		with self.connection:
+			self.connection.execute("CREATE TABLE IF NOT EXISTS problems (file TEXT PRIMARY KEY, data TEXT, correctness_test_suite TEXT)")
+			self.connection.execute("CREATE TABLE IF NOT EXISTS solutions (model TEXT, problem TEXT, prompt TEXT, data TEXT, PRIMARY KEY (model, problem, prompt))")
+			self.connection.execute("CREATE TABLE IF NOT EXISTS grades (model TEXT, grader TEXT, problem TEXT, prompt TEXT, data TEXT, PRIMARY KEY (model, grader, problem, prompt))")
+	
+	def query(self, sql: str, parameters: tuple = ()) -> list:
+		with self.lock:
+			return self.connection.execute(sql, parameters).fetchall()
+	
+	def put_problem(self, file: str, problemJSON: dict):
+		problemJSON = dict(problemJSON)
+		correctness_test_suite = problemJSON.pop('correctness_test_suite', None)
+		with self.lock, self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO problems VALUES (?, ?, ?)", (file, json.dumps(problemJSON), json.dumps(correctness_test_suite)))
+	
+	def get_problems_json(self, include_test_suites: bool = True) -> Dict[str, dict]:
+		problemsJSON = {}
+		for file, data, correctness_test_suite in self.query(f"SELECT file, data, {'correctness_test_suite' if include_test_suites else 'NULL'} FROM problems ORDER BY file"):
+			problemJSON = json.loads(data)
+			correctness_test_suite = json.loads(correctness_test_suite) if correctness_test_suite else None
+			if correctness_test_suite is not None:
+				problemJSON['correctness_test_suite'] = correctness_test_suite
+			problemsJSON[file] = problemJSON
+		return problemsJSON
+	
+	def get_correctness_test_suite(self, file: str) -> List[TestCase]:
+		rows = self.query("SELECT correctness_test_suite FROM problems WHERE file = ?", (file,))
+		correctness_test_suite = json.loads(rows[0][0]) if rows and rows[0][0] else []
+		return [TestCase.from_json(test_case) for test_case in correctness_test_suite]
+	
+	def put_solution(self, solution: LLMSolution):
+		with self.lock, self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)",
+				(solution.model_identifier, solution.problem_identifier, solution.prompt_identifier, json.dumps(solution.to_json())))
+	
+	def get_solutions(self, model_identifier: Optional[str] = None) -> List[LLMSolution]:
+		if model_identifier is None:
+			rows = self.query("SELECT data FROM solutions ORDER BY model, problem, prompt")
+		else:
+			rows = self.query("SELECT data FROM solutions WHERE model = ? ORDER BY problem, prompt", (model_identifier,))
+		return [LLMSolution.from_json(json.loads(data)) for data, in rows]
+	
+	def put_grade(self, grader_identifier: str, solutionGrade: SolutionGrade):
+		with self.lock, self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO grades VALUES (?, ?, ?, ?, ?)",
+				(solutionGrade.model_identifier, grader_identifier, solutionGrade.problem_identifier, solutionGrade.prompt_identifier, json.dumps(solutionGrade.to_json())))
+	
+	def get_grades(self, model_identifier: Optional[str] = None, grader_identifier: Optional[str] = None) -> List[Tuple[str, SolutionGrade]]:
+		"""
+		Returns (grader identifier, grade) pairs, optionally restricted to a model and grader.
+		"""
+		rows = self.query("SELECT grader, data FROM grades WHERE (? IS NULL OR model = ?) AND (? IS NULL OR grader = ?) ORDER BY model, grader, problem, prompt",
+			(model_identifier, model_identifier, grader_identifier, grader_identifier))
+		return [(grader, SolutionGrade.from_json(json.loads(data))) for grader, data in rows]
+	
+	def close(self):
+		with self.lock:
+			self.connection.close()
+
+_packed_problem_sets = {}
+_packed_problem_sets_lock = threading.Lock()
+
+def get_packed_problem_set(basePath: str) -> Optional[PackedProblemSet]:
+	"""
+	Returns the packed form of the problem set at basePath, or None if it is stored as directories.
+	"""
+	path = os.path.join(basePath, PACKED_FILE_NAME)
+	with _packed_problem_sets_lock:
+		packed = _packed_problem_sets.get(path)
+		if packed is None and os.path.exists(path):
+			packed = _packed_problem_sets[path] = PackedProblemSet(path)
+		return packed
+
+def close_packed_problem_set(basePath: str):
+	path = os.path.join(basePath, PACKED_FILE_NAME)
+	with _packed_problem_sets_lock:
+		packed = _packed_problem_sets.pop(path, None)
+	if packed is not None:
+		packed.close()
 
 def get_problems_json(basePath: str):
+	packed = get_packed_problem_set(basePath)
+	if packed is not None:
+		print(f'Loading {packed.path}…')
+		return packed.get_problems_json()
+	
 	problemsJSON = {}
 	problemsDirectory = os.path.join(basePath, "problems")
 	for problem_file in [file for file in sorted(os.listdir(problemsDirectory)) if not file.startswith('.')]:
@@ -13,10 +116,37 @@ def get_problems_json(basePath: str):
 		problemsJSON[problem_file] = problemJSON
 	return problemsJSON		
 
+def get_problem_paths(basePath: str) -> List[str]:
+	problemsDirectory = os.path.join(basePath, "problems")
+	return [os.path.join(problemsDirectory, file) for file in sorted(os.listdir(problemsDirectory)) if not file.startswith('.')]
+
+def iter_problems(basePath: str):
+	"""
+	Yields the problems of a problem set one at a time. The test cases of each problem are only built when a
+	grader first uses them: those of a packed problem set are then read from the packed file, and those of a
+	problem stored as a file from the JSON already parsed along with the rest of the problem.
+	"""
+	packed = get_packed_problem_set(basePath)
+	if packed is not None:
+		for file, problemJSON in packed.get_problems_json(include_test_suites=False).items():
+			yield ProblemDefinition.from_json(problemJSON, lambda file=file: packed.get_correctness_test_suite(file))
+		return
+	
+	for problemPath in get_problem_paths(basePath):
+		with open(problemPath) as f:
+			problemJSON = json.load(f)
+		test_suite_json = problemJSON.pop('correctness_test_suite', [])
+		yield ProblemDefinition.from_json(problemJSON, lambda test_suite_json=test_suite_json: [TestCase.from_json(test_case) for test_case in test_suite_json])
+
 def get_problems(basePath: str):
-	return [ProblemDefinition.from_json(x) for x in get_problems_json(basePath).values()]
+	return list(iter_problems(basePath))
 
 def save_solution(basePath: str, solution: LLMSolution):
+	packed = get_packed_problem_set(basePath)
+	if packed is not None:
+		packed.put_solution(solution)
+		return
+	
 	directoryPath = os.path.join(basePath, "solutions", solution.model_identifier, solution.problem_identifier)
 	pathlib.Path(directoryPath).mkdir(parents=True, exist_ok=True)
 	path = os.path.join(directoryPath, solution.prompt_identifier + ".json")
@@ -27,6 +157,10 @@ def save_solution(basePath: str, solution: LLMSolution):
 		f.write(jsonString)
 
 def get_solutions(basePath: str, model_identifier: str):
+	packed = get_packed_problem_set(basePath)
+	if packed is not None:
+		return packed.get_solutions(model_identifier)
+	
 	solutions = []
 	solutionsDirectory = os.path.join(basePath, "solutions", model_identifier)
 
@@ -43,44 +177,141 @@ def get_solutions(basePath: str, model_identifier: str):
 	return solutions		
 
 
-def update_report(basePath: str, grades: GradingOutput, solutionGrade: SolutionGrade, current_report_path: str):
-	if os.path.exists(current_report_path):
-			with open(current_report_path, 'r') as f:
-				report = json.load(f)
-	else:
-		report = {
-			"Problem Sets": {},
-			"Average Scores Per Problem Set": {},
-			"Average Scores Per Criterion": {}
-		}
-
-	problem_set_name = basePath
-	if problem_set_name not in report["Problem Sets"]:
-		report["Problem Sets"][problem_set_name] = {}
-	if grades.grader_identifier not in report["Problem Sets"][problem_set_name]:
-		report["Problem Sets"][problem_set_name][grades.grader_identifier] = []
-
-	report["Problem Sets"][problem_set_name][grades.grader_identifier].append(solutionGrade.to_json())
-
-	# update average score for problem set
-	all_scores = [problem["score"] for grader in report["Problem Sets"][problem_set_name].values() for problem in grader]
-	avg_score = sum(all_scores) / len(all_scores)
-	report["Average Scores Per Problem Set"][problem_set_name] = avg_score
+# Number of grades a ReportWriter takes between rewrites of the summary report
+REPORT_CHECKPOINT_INTERVAL = 50
 
-	# update average score for grading metric
-	all_scores_for_grader = [problem["score"] for pset in report["Problem Sets"].values() for problem in pset.get(grades.grader_identifier, [])]
-	avg_score_for_grader = sum(all_scores_for_grader) / len(all_scores_for_grader) if all_scores_for_grader else 0
-	report["Average Scores Per Criterion"][grades.grader_identifier] = avg_score_for_grader
-    
-	pathlib.Path(os.path.dirname(current_report_path)).mkdir(parents=True, exist_ok=True)
-	with open(current_report_path, 'w') as f:
-		json.dump(report, f, indent=4)	
+class ReportWriter:
+	"""
+	Builds the report for a run incrementally.
+	Each grade is appended to a JSON-Lines log next to the report as soon as it arrives, while running sums and
+	counts are kept in memory; the summary report itself is only rewritten at checkpoints and when the writer is
+	closed. If the log already exists, for instance after an interrupted run, its grades are replayed first so the
+	run can resume where it stopped.
+	"""
+	def __init__(self, report_path: str, checkpoint_interval: int = REPORT_CHECKPOINT_INTERVAL):
+		self.report_path = report_path
+		self.log_path = os.path.splitext(report_path)[0] + ".jsonl"
+		self.checkpoint_interval = checkpoint_interval
+		self.problem_sets = {}
+		self.problem_set_totals = {}
+		self.grader_totals = {}
+		self.recorded = set()
+		self.pending = 0
+		self.log_file = None
+		self.replay_log()
+	
+	def replay_log(self):
+		if not os.path.exists(self.log_path):
+			return
+		valid_length = 0
+		with open(self.log_path, 'rb') as f:
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# A partially written line from an interrupted run; drop it and everything after it
+					break
+				if not line.endswith(b'\n'):
+					break
+				self.record(entry)
+				valid_length += len(line)
+		if valid_length != os.path.getsize(self.log_path):
+			with open(self.log_path, 'r+b') as f:
+				f.truncate(valid_length)
+		if self.recorded:
+			print(f"Resumed {len(self.recorded)} grades from {self.log_path}")
+	
+	def record(self, entry: dict):
+		problem_set_name = entry["problem_set"]
+		grader_identifier = entry["grader_identifier"]
+		grade = entry["grade"]
+		self.problem_sets.setdefault(problem_set_name, {}).setdefault(grader_identifier, []).append(grade)
+	
+		for totals, key in ((self.problem_set_totals, problem_set_name), (self.grader_totals, grader_identifier)):
+			total = totals.setdefault(key, [0, 0])
+			total[0] += grade["score"]
+			total[1] += 1
+	
+		self.recorded.add((problem_set_name, grader_identifier, grade["model_identifier"], grade["problem_identifier"], grade["prompt_identifier"]))
+	
+	def has_grade(self, basePath: str, grader_identifier: str, solution: LLMSolution) -> bool:
+		"""
+		Whether a grade for solution by the given grader has already been recorded in this report.
+		"""
+		return (basePath, grader_identifier, solution.model_identifier, solution.problem_identifier, solution.prompt_identifier) in self.recorded
+	
+	def add(self, basePath: str, grader_identifier: str, solutionGrade: SolutionGrade):
+		entry = {
+			"problem_set": basePath,
+			"grader_identifier": grader_identifier,
+			"grade": solutionGrade.to_json()
+		}
+		if self.log_file is None:
+			pathlib.Path(os.path.dirname(self.log_path) or '.').mkdir(parents=True, exist_ok=True)
+			self.log_file = open(self.log_path, 'a')
+		self.log_file.write(json.dumps(entry) + "\n")
+		self.log_file.flush()
+		os.fsync(self.log_file.fileno())
+	
+		self.record(entry)
+		self.pending += 1
+		if self.pending >= self.checkpoint_interval:
+			self.checkpoint()
+	
+	def summary(self) -> dict:
+		return {
+			"Problem Sets": self.problem_sets,
+			"Average Scores Per Problem Set": {name: total / count for name, (total, count) in self.problem_set_totals.items()},
+			"Average Scores Per Criterion": {name: total / count for name, (total, count) in self.grader_totals.items()}
+		}
+	
+	def checkpoint(self):
+		"""
+		Atomically rewrites the summary report from the running totals.
+		"""
+		self.pending = 0
+		if not self.recorded:
+			return
+		pathlib.Path(os.path.dirname(self.report_path) or '.').mkdir(parents=True, exist_ok=True)
+		temporary_path = self.report_path + ".tmp"
+		with open(temporary_path, 'w') as f:
+			json.dump(self.summary(), f, indent=4)
+		os.replace(temporary_path, self.report_path)
+	
+	def close(self):
+		self.checkpoint()
+		if self.log_file is not None:
+			self.log_file.close()
+			self.log_file = None
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.close()
 
+def save_profile(basePath: str, grader_identifier: str, solutionGrade: SolutionGrade):
+	"""
+	Writes the profile of a grade, if it has one, to grades/<model>/<grader>/<problem>/<prompt>.prof, a file that
+	pstats and other cProfile viewers can read. Profiles are kept in files even for packed problem sets.
+	"""
+	if solutionGrade.profile is None:
+		return
+	directoryPath = os.path.join(basePath, "grades", solutionGrade.model_identifier, grader_identifier, solutionGrade.problem_identifier)
+	pathlib.Path(directoryPath).mkdir(parents=True, exist_ok=True)
+	with open(os.path.join(directoryPath, solutionGrade.prompt_identifier + ".prof"), 'wb') as f:
+		f.write(base64.b64decode(solutionGrade.profile))
 
-	
-def save_grades(basePath: str, grades: GradingOutput, current_report_path: str):
+def save_grades(basePath: str, grades: GradingOutput, report_writer: ReportWriter):
 	# print(grades.solution_grades)
+	packed = get_packed_problem_set(basePath)
 	for solutionGrade in grades.solution_grades:
+		if packed is not None:
+			packed.put_grade(grades.grader_identifier, solutionGrade)
+			save_profile(basePath, grades.grader_identifier, solutionGrade)
+			report_writer.add(basePath, grades.grader_identifier, solutionGrade)
+			continue
+		
 		directoryPath = os.path.join(basePath, "grades", solutionGrade.model_identifier, grades.grader_identifier, solutionGrade.problem_identifier)
 		pathlib.Path(directoryPath).mkdir(parents=True, exist_ok=True)
 		path = os.path.join(directoryPath, solutionGrade.prompt_identifier + ".json")
@@ -90,20 +321,81 @@ def save_grades(basePath: str, grades: GradingOutput, current_report_path: str):
 			jsonString = json.dumps(solutionGrade.to_json(), indent=4)
 			f.write(jsonString)
 		
-		update_report(basePath, grades, solutionGrade, current_report_path)
+		save_profile(basePath, grades.grader_identifier, solutionGrade)
+		report_writer.add(basePath, grades.grader_identifier, solutionGrade)
 		
 			
 def get_grades(basePath: str, model_identifier: str, grader_identifier: str):
+	packed = get_packed_problem_set(basePath)
+	if packed is not None:
+		return GradingOutput([grade for _, grade in packed.get_grades(model_identifier, grader_identifier)], grader_identifier)
+	
 	grades = []
 	gradesDirectory = os.path.join(basePath, "grades", model_identifier, grader_identifier)
 	
 	for problemName in [file for file in sorted(os.listdir(gradesDirectory)) if not file.startswith('.')]:
 		problemDirectory = os.path.join(gradesDirectory, problemName)
 	
-		for grade_file in [file for file in sorted(os.listdir(problemDirectory)) if not file.startswith('.')]:
+		for grade_file in [file for file in sorted(os.listdir(problemDirectory)) if not file.startswith('.') and file.endswith('.json')]:
 			gradePath = os.path.join(problemDirectory, grade_file)
 			# print(gradePath)
 			with open(gradePath) as f:
 				gradeJSON = json.loads(f.read())
 			grades.append(SolutionGrade.from_json(gradeJSON))
 	return GradingOutput(grades, grader_identifier)		
+
+def list_directory(path: str) -> List[str]:
+	return [file for file in sorted(os.listdir(path)) if not file.startswith('.')] if os.path.isdir(path) else []
+
+def pack_problem_set(basePath: str):
+	"""
+	Packs the problems/, solutions/ and grades/ directories of a problem set into its packed file, which is used
+	in place of the directories from then on. The directories are left untouched.
+	"""
+	path = os.path.join(basePath, PACKED_FILE_NAME)
+	if os.path.exists(path):
+		raise FileExistsError(f"{path} already exists. Unpack it first to pack the directories again.")
+	
+	temporary_path = path + ".tmp"
+	if os.path.exists(temporary_path):
+		os.unlink(temporary_path)
+	packed = PackedProblemSet(temporary_path)
+	try:
+		for file, problemJSON in get_problems_json(basePath).items():
+			packed.put_problem(file, problemJSON)
+		solutionsDirectory = os.path.join(basePath, "solutions")
+		for model_identifier in list_directory(solutionsDirectory):
+			for solution in get_solutions(basePath, model_identifier):
+				packed.put_solution(solution)
+		gradesDirectory = os.path.join(basePath, "grades")
+		for model_identifier in list_directory(gradesDirectory):
+			for grader_identifier in list_directory(os.path.join(gradesDirectory, model_identifier)):
+				for solutionGrade in get_grades(basePath, model_identifier, grader_identifier).solution_grades:
+					packed.put_grade(grader_identifier, solutionGrade)
+	finally:
+		packed.close()
+	os.replace(temporary_path, path)
+
+def unpack_problem_set(basePath: str):
+	"""
+	Writes the contents of a problem set's packed file back to its problems/, solutions/ and grades/ directories,
+	then removes the packed file.
+	"""
+	packed = get_packed_problem_set(basePath)
+	if packed is None:
+		raise FileNotFoundError(f"{os.path.join(basePath, PACKED_FILE_NAME)} does not exist.")
+	
+	def write_json(path: str, data: dict):
+		pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+		with open(path, 'w') as f:
+			f.write(json.dumps(data, indent=4))
+	
+	for file, problemJSON in packed.get_problems_json().items():
+		write_json(os.path.join(basePath, "problems", file), problemJSON)
+	for solution in packed.get_solutions():
+		write_json(os.path.join(basePath, "solutions", solution.model_identifier, solution.problem_identifier, solution.prompt_identifier + ".json"), solution.to_json())
+	for grader_identifier, solutionGrade in packed.get_grades():
+		write_json(os.path.join(basePath, "grades", solutionGrade.model_identifier, grader_identifier, solutionGrade.problem_identifier, solutionGrade.prompt_identifier + ".json"), solutionGrade.to_json())
+	
+	close_packed_problem_set(basePath)
+	os.unlink(os.path.join(basePath, PACKED_FILE_NAME))
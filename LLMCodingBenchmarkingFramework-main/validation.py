@@ -221,18 +221,46 @@ def validate_problem_json(problem_json: dict) -> (bool, str):
 	
 	if "tags" in problem_json and not all(isinstance(tag, str) for tag in problem_json["tags"]):
 		return False, "All elements in field 'tags' should be strings"
+	
+	if "execution_limits" in problem_json:
+		execution_limits = problem_json["execution_limits"]
+		if not isinstance(execution_limits, dict):
+			return False, "Field 'execution_limits' should be an object"
+		for name, value in execution_limits.items():
+			if name not in execution.DEFAULT_LIMITS:
+				return False, f"Unknown execution limit '{name}'. Expected one of: {', '.join(execution.DEFAULT_LIMITS)}"
+			if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+				return False, f"Execution limit '{name}' should be a positive number or null"
 		
+	if "input_generator" in problem_json:
+		if not isinstance(problem_json["input_generator"], str):
+			return False, "Field 'input_generator' should be a string"
+		if not "function_prototype" in problem_json:
+			return False, "Function prototype must be present if an input generator is provided."
+		# Generate the smallest input and check that it holds the function's parameters
+		try:
+			generated_input = execution.define_function(problem_json["input_generator"])(1)
+			if not isinstance(generated_input, dict):
+				return False, f"Input generator must return an object. Found: {type(generated_input).__name__}."
+			FunctionPrototype(problem_json["function_prototype"]).order_parameter_values(generated_input)
+		except Exception as e:
+			return False, f"Got exception while generating an input of size 1: {e}"
+	
 	if 'optimal_solution' in problem_json and 'correctness_test_suite' in problem_json:
-		# Ensure that the optimal solution passes the correctness test suite
-		for index, test_case in enumerate(problem_json["correctness_test_suite"]):
-			test_case_obj = TestCase(test_case)
-			parameters = function_prototype.get_ordered_parameter_values(test_case_obj)
+		# Ensure that the optimal solution passes the correctness test suite, running the whole suite in one batch
+		test_case_objs = [TestCase(test_case) for test_case in problem_json["correctness_test_suite"]]
+		parameter_lists = [function_prototype.get_ordered_parameter_values(test_case_obj) for test_case_obj in test_case_objs]
+		all_execution_results = execution.get_default_pool().execute_batch(problem_json["optimal_solution"], parameter_lists, limits=problem_json.get("execution_limits"))
+		
+		failures = []
+		for test_case_obj, parameters, execution_results in zip(test_case_objs, parameter_lists, all_execution_results):
 			expected_result = function_prototype.get_return_values(test_case_obj)
-			execution_results = execution.execute_function(problem_json["optimal_solution"], parameters, iterations=1, collect_cpu_time=False, collect_memory_usage=False)
 			parameters_desc = ', '.join([f'{p} {type(p)}' for p in parameters])
 			if execution_results.error:
-				return False, f"Optimal solution encountered error for test case {test_case_obj}. Parameters: {parameters_desc}; Error: {execution_results.error}"
-			if expected_result != execution_results.result:
-				return False, f"Optimal solution did not pass test case {test_case_obj}. Parameters: {parameters_desc}; Expected result: {expected_result} {type(expected_result)}; Actual result: {execution_results.result} {type(execution_results.result)}"
+				failures.append(f"Optimal solution encountered error for test case {test_case_obj}. Parameters: {parameters_desc}; Error: {execution_results.error}")
+			elif expected_result != execution_results.result:
+				failures.append(f"Optimal solution did not pass test case {test_case_obj}. Parameters: {parameters_desc}; Expected result: {expected_result} {type(expected_result)}; Actual result: {execution_results.result} {type(execution_results.result)}")
+		if failures:
+			return False, "\n".join(failures)
 	
 	return True, "Validation successful"
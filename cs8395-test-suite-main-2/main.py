@@ -1,13 +1,13 @@
 import argparse
-import glob
-import itertools
 import os
 import statistics
 import subprocess
 import json
+import threading
 import yaml
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import rmtree
 
 # Parse arguments
@@ -16,64 +16,188 @@ parser.add_argument("--repos", help=".repos file to import", required=True)
 parser.add_argument("--model", help="Model to run all test suites against", required=False)
 parser.add_argument("--config-view", help="Without running tests, get config breakdown of all repos", required=False, action="store_true")
 parser.add_argument("--tags", help="Use repos that have one or more of these tags (space separated)", nargs="+", required=False)
+parser.add_argument("--jobs", help="Number of repos to clone and run at the same time", type=int, default=1)
+parser.add_argument("--mirror", help="Directory of local clones or git mirrors, named after each repo, to clone from instead of its url", required=False)
+parser.add_argument("--logs", help="Directory in which each repo's test and scoring output is written to <repo>.log", default="logs")
+parser.add_argument("--force", help="Rerun every suite, even those whose commit and model are unchanged since their last output", required=False, action="store_true")
 args = parser.parse_args()
 
-# Clone repos
-rmtree("repos", ignore_errors=True)
-os.mkdir("repos")
-with open(args.repos) as stream:
+print_lock = threading.Lock()
+
+
+def log(repo_name, message):
+    with print_lock:
+        print(f"[{repo_name}] {message}")
+
+
+def clone_url(repo_name, repo):
+    # Prefer a local clone or mirror of the repo when one is available
+    if args.mirror is not None:
+        mirror = os.path.join(args.mirror, repo_name)
+        if os.path.isdir(mirror):
+            return os.path.abspath(mirror)
+    return repo["url"]
+
+
+def git(repo_name, *arguments, cwd=None):
+    p = subprocess.run(["git", *arguments], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        log(repo_name, f"'git {' '.join(arguments)}' failed:\n{p.stderr.decode('utf-8')}")
+        return None
+    return p.stdout.decode("utf-8").strip()
+
+
+def state_path(repo_name):
+    return os.path.join("repos", f"{repo_name}.state.json")
+
+
+def load_state(repo_name):
+    # The state records which url and version a clone is of, and the commit and model of its last output
     try:
-        repos = yaml.safe_load(stream)
-    except yaml.YAMLError as exc:
-        print(exc)
-        exit(1)
+        with open(state_path(repo_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(repo_name, state):
+    with open(state_path(repo_name), "w") as f:
+        f.write(json.dumps(state, indent=4))
+
+
+def sync_repo(repo_name, repo, state):
+    """
+    Brings the cached clone of a repo up to date with its url and version, cloning only when there is no usable
+    clone and otherwise fetching the version, so that new commits on a branch are picked up. Returns the checked
+    out commit, or None.
+    """
+    directory = os.path.join("repos", repo_name)
+    url = clone_url(repo_name, repo)
+    version = str(repo["version"])
+    if state.get("url") != url or not os.path.isdir(os.path.join(directory, ".git")):
+        rmtree(directory, ignore_errors=True)
+        state.clear()
+        log(repo_name, "Cloning...")
+        if git(repo_name, "clone", url, "-b", version, directory) is None:
+            return None
+    else:
+        log(repo_name, f"Fetching {version}...")
+        if git(repo_name, "fetch", "origin", version, cwd=directory) is None:
+            return None
+        if git(repo_name, "checkout", "--force", "FETCH_HEAD", cwd=directory) is None:
+            return None
+
+    commit = git(repo_name, "rev-parse", "HEAD", cwd=directory)
+    if commit is None:
+        return None
+    if state.get("commit") != commit:
+        # Outputs of another commit are stale
+        state.pop("model", None)
+    state.update(url=url, version=version, commit=commit)
+    save_state(repo_name, state)
+    return commit
+
 
-for repo_name in repos["repositories"]:
-    repo = repos["repositories"][repo_name]
-    print(f"Cloning {repo_name}...")
-    subprocess.Popen(f"git clone {repo['url']} -b {repo['version']} repos/{repo_name}", shell=True, stdout=subprocess.DEVNULL).wait()
+def run_script(repo_name, directory, command, log_file):
+    # Stream the script's output to the repo's log instead of buffering it
+    log_file.write(f"$ {command}\n")
+    log_file.flush()
+    p = subprocess.run(command, cwd=directory, shell=True, stdout=log_file, stderr=subprocess.STDOUT)
+    log_file.write(f"\n[exit code {p.returncode}]\n\n")
+    log_file.flush()
+    if p.returncode != 0:
+        log(repo_name, f"'{command}' exited with code {p.returncode}, see {log_file.name}")
 
-# Run tests for each repo
-outputs = []
-for file in itertools.chain(glob.glob("repos/*/config.json")):
-    directory = os.path.dirname(file)
+
+def run_suite(repo_name, directory, data):
+    # Run scripts
+    with open(os.path.join(args.logs, f"{repo_name}.log"), "w") as log_file:
+        if "run_test" in data:
+            log(repo_name, "Running test script!")
+            run_script(repo_name, directory, f"{data['run_test']} --model {data['model']}", log_file)
+
+        if "run_score" in data:
+            log(repo_name, "Running scoring script!")
+            run_script(repo_name, directory, f"{data['run_score']} --model {data['model']}", log_file)
+
+
+def run_repo(repo_name, repo):
+    """
+    Brings a repo up to date and runs its test suite, returning its output, or None if it was skipped or produced
+    no output. Suites whose commit and model are unchanged since their last output are not rerun.
+    """
+    state = load_state(repo_name)
+    if sync_repo(repo_name, repo, state) is None:
+        return None
+
+    directory = os.path.join("repos", repo_name)
+    file = os.path.join(directory, "config.json")
+    if not os.path.exists(file):
+        log(repo_name, "No config.json, skipped.")
+        return None
     data = json.loads(open(file).read())
-    print(f"* {data['name']}")
     if args.model is not None:
         data["model"] = args.model
 
     if args.tags is not None:
         if len(set(args.tags).intersection(set(data["tags"]))) == 0:
-            print("No tag match, skipped.")
-            continue
+            log(repo_name, "No tag match, skipped.")
+            return None
 
     if args.config_view is True:
-        print(f"Default Model: {data['model']}")
-        print(f"Tags: {data['tags']}")
-        continue
+        log(repo_name, f"{data['name']}\nDefault Model: {data['model']}\nTags: {data['tags']}")
+        return None
 
-    # Run scripts
-    if "run_test" in data:
-        print("Running test script!")
-        p = subprocess.run(f"{data['run_test']} --model {data['model']}", cwd=os.path.dirname(file), shell=True, capture_output=True)
-        if p.stderr:
-            print(p.stdout.decode("utf-8"))
-            print("------")
-            print(p.stderr.decode("utf-8"))
-
-    if "run_score" in data:
-        print("Running scoring script!")
-        p = subprocess.run(f"{data['run_score']} --model {data['model']}", cwd=os.path.dirname(file), shell=True, capture_output=True)
-        if p.stderr:
-            print(p.stdout.decode("utf-8"))
-            print("------")
-            print(p.stderr.decode("utf-8"))
+    output_path = os.path.join(directory, "output.json")
+    if state.get("model") == data["model"] and not args.force and os.path.exists(output_path):
+        log(repo_name, "Unchanged since its last run, reusing its output.")
+    else:
+        state.pop("model", None)
+        save_state(repo_name, state)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        run_suite(repo_name, directory, data)
+        if os.path.exists(output_path):
+            state["model"] = data["model"]
+            save_state(repo_name, state)
 
     # Get test output
-    output = json.loads(open(os.path.join(directory, "output.json")).read())
+    if not os.path.exists(output_path):
+        log(repo_name, f"No output.json was produced, see {os.path.join(args.logs, repo_name + '.log')}")
+        return None
+    output = json.loads(open(output_path).read())
     output["tags"] = data["tags"]
     output["name"] = data["name"]
-    outputs.append(output)
+    log(repo_name, f"Finished with score {output['output']}")
+    return output
+
+
+# Clones are kept in repos/ between runs and updated by fetching instead of cloning again
+os.makedirs("repos", exist_ok=True)
+os.makedirs(args.logs, exist_ok=True)
+with open(args.repos) as stream:
+    try:
+        repos = yaml.safe_load(stream)
+    except yaml.YAMLError as exc:
+        print(exc)
+        exit(1)
+
+# Update and run the repos concurrently, collecting outputs as the suites finish
+outputs_by_repo = {}
+with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    futures = {executor.submit(run_repo, repo_name, repo): repo_name for repo_name, repo in repos["repositories"].items()}
+    for future in as_completed(futures):
+        repo_name = futures[future]
+        try:
+            output = future.result()
+        except Exception as e:
+            log(repo_name, f"Failed: {e}")
+            continue
+        if output is not None:
+            outputs_by_repo[repo_name] = output
+
+# Report in repo order, whatever order the suites finished in
+outputs = [outputs_by_repo[repo_name] for repo_name in sorted(outputs_by_repo)]
 
 # Coalesce output
 if len(outputs) == 0:
@@ -89,7 +213,7 @@ for output in outputs:
     scores.append(output["output"])
     for tag in output["tags"]:
         score_by_tag[tag].append(output["output"])
-    
+
     items = list(output.items())
     if len(items) > 3:
         for item in items:
@@ -111,4 +235,4 @@ output = {
 }
 
 with open("output.json", "w") as f:
-    f.write(json.dumps(output, indent=4))
\ No newline at end of file
+    f.write(json.dumps(output, indent=4))